@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+import struct
+
+from manifest import hash_file
+from walk import walk_tree
+
+# Written into docs/ next to the assets, for deploy scripts and CDNs
+ASSET_MANIFEST_NAME = "asset-manifest.json"
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def fingerprint_name(relpath, file_hash):
+    # images/tolkien.png -> images/tolkien.3f2a9c1b04.png
+    root, extension = os.path.splitext(relpath)
+    return f"{root}.{file_hash[:10]}{extension}"
+
+
+def png_size(path):
+    # Width and height from the IHDR chunk, which always comes first
+    with open(path, "rb") as f:
+        header = f.read(24)
+    if len(header) < 24 or not header.startswith(PNG_SIGNATURE) or header[12:16] != b"IHDR":
+        return None
+    return struct.unpack(">II", header[16:24])
+
+
+class AssetManifest:
+    # Where every file of static/ ends up when assets are fingerprinted,
+    # keyed by its site path ("/images/tolkien.png")
+    def __init__(self, files=None):
+        # site path -> {"path", "size", "mtime", "hash", and "width"/"height" for images}
+        self.files = files if files is not None else {}
+        self.digest = hashlib.sha256(json.dumps(self.urls(), sort_keys=True).encode("utf-8")).hexdigest()
+
+    @classmethod
+    def build(cls, static_dir, previous=None):
+        # Only files whose size or mtime moved since `previous` are hashed again
+        old_files = previous.files if previous is not None else {}
+        files = {}
+        for dir_entry, relpath in walk_tree(static_dir):
+            relpath = relpath.replace(os.sep, "/")
+            stat = dir_entry.stat()
+            entry = old_files.get("/" + relpath)
+            if entry is None or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime_ns:
+                file_hash = hash_file(dir_entry.path)
+                entry = {
+                    "path": "/" + fingerprint_name(relpath, file_hash),
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime_ns,
+                    "hash": file_hash,
+                }
+                size = png_size(dir_entry.path) if dir_entry.name.lower().endswith(".png") else None
+                if size is not None:
+                    entry["width"], entry["height"] = size
+            files["/" + relpath] = entry
+        return cls(files)
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return cls(json.load(f))
+        except (OSError, ValueError):
+            return cls()
+
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.files, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    def urls(self):
+        return {site_path: entry["path"] for site_path, entry in self.files.items()}
+
+    def names(self):
+        # static/ relpath -> docs/ relpath, for sync_files_recursive
+        return {site_path[1:]: entry["path"][1:] for site_path, entry in self.files.items()}
+
+    def get(self, site_path):
+        return self.files.get(site_path)
+
+    def hash(self, site_path):
+        entry = self.files.get(site_path)
+        return entry["hash"] if entry is not None else None
+
+    def is_current(self, hashes):
+        # Whether every (site path, hash) pair a page or block looked up is
+        # still the same, a None hash meaning the file wasn't there
+        return all(self.hash(site_path) == file_hash for site_path, file_hash in hashes)
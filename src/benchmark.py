@@ -0,0 +1,339 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from io import StringIO
+
+from textnode import TextNode, TextType, split_nodes_delimiter
+from inline import text_to_textnodes, split_node_links, split_node_images
+from block import markdown_to_html_node, text_to_children
+from textnode import text_node_to_html_node
+from block import iter_blocks, iter_typed_blocks, block_to_block_type, block_to_html
+from template import compile_template, load_template
+from urls import UrlResolver
+from htmlnode import ParentNode
+from page_generator import find_pages
+from copystatic import sync_files_recursive
+from build import build_site
+from corpus import CorpusSpec, generate_corpus
+
+
+def multipass_text_to_textnodes(text):
+    # The old five-pass pipeline, kept here as the baseline to compare against
+    node = [TextNode(text, TextType.TEXT)]
+    node = split_nodes_delimiter(node, "`", TextType.CODE)
+    node = split_nodes_delimiter(node, "**", TextType.BOLD)
+    node = split_nodes_delimiter(node, "_", TextType.ITALIC)
+    node = split_node_links(node)
+    node = split_node_images(node)
+    return node
+
+
+# Pathological paragraphs: one huge line with n inline elements in it
+INLINE_CASES = {
+    "links": lambda n: " ".join(f"see [link {i}](https://example.com/{i})" for i in range(n)),
+    "images": lambda n: " ".join(f"![image {i}](/images/{i}.png)" for i in range(n)),
+    "delimiters": lambda n: " ".join(f"**b{i}** _i{i}_ `c{i}`" for i in range(n)),
+    "mixed": lambda n: " ".join(f"**b{i}** [l{i}](/p/{i}) ![a{i}](/i/{i}.png) `c{i}`" for i in range(n)),
+}
+
+
+def best_time(func, arg, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(arg)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench_inline(sizes, repeat=3, baseline=True):
+    results = []
+    for case, make_text in INLINE_CASES.items():
+        for n in sizes:
+            text = make_text(n)
+            row = {"case": case, "n": n, "single_pass": best_time(text_to_textnodes, text, repeat)}
+            if baseline:
+                row["multipass"] = best_time(multipass_text_to_textnodes, text, repeat)
+            results.append(row)
+    return results
+
+
+def print_inline(results):
+    print(f"{'case':<12}{'n':>8}{'single pass':>14}{'us/elem':>10}{'multipass':>14}")
+    for row in results:
+        per_element = row["single_pass"] / row["n"] * 1e6
+        line = f"{row['case']:<12}{row['n']:>8}{row['single_pass']:>13.4f}s{per_element:>10.2f}"
+        if "multipass" in row:
+            line += f"{row['multipass']:>13.4f}s"
+        print(line)
+
+
+def make_long_page(sections):
+    # A changelog-style page: lots of headings, lists and code
+    blocks = ["# Changelog"]
+    for i in range(sections):
+        blocks.append(f"## Release {i}")
+        blocks.append("\n".join(f"- Fixed [issue {i}-{j}](/issues/{j}) in **module {j}**" for j in range(10)))
+        blocks.append(f"```\npip install package=={i}\n```")
+    return "\n\n".join(blocks)
+
+
+def peak_memory(func):
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def bench_render_memory(sections, basepath="/blog/"):
+    markdown = make_long_page(sections)
+    node = markdown_to_html_node(markdown)
+    # The same tree with the basepath applied to its link and image nodes
+    resolver = UrlResolver(basepath)
+    resolved = ParentNode("div", [block_to_html(block, block_type, resolver)
+                                  for block, block_type, _ in iter_typed_blocks(markdown.split("\n"))])
+    template = compile_template("<html><body>{{ Content }}</body></html>", basepath)
+
+    def concatenated():
+        # What generate_page used to do: one string for the content,
+        # another for the filled template, two more for the basepath replaces
+        html = node.to_html()
+        full_html = "<html><body>{{ Content }}</body></html>".replace("{{ Content }}", html)
+        full_html = full_html.replace('href="/', f'href="{basepath}').replace('src="/', f'src="{basepath}')
+        with open(os.devnull, "w", encoding="utf-8") as f:
+            f.write(full_html)
+
+    def streamed():
+        with open(os.devnull, "w", encoding="utf-8", buffering=1 << 16) as f:
+            template.write(f.write, {"Content": resolved.write_html})
+
+    size = len(resolved.to_html())
+    return {"bytes": size, "concatenated_peak": peak_memory(concatenated), "streamed_peak": peak_memory(streamed)}
+
+
+class DictTextNode:
+    # TextNode/LeafNode as they were before __slots__, for the "before" numbers
+    def __init__(self, text, text_type, url=None):
+        self.text = text
+        self.text_type = text_type
+        self.url = url
+
+
+class DictLeafNode:
+    def __init__(self, tag, value, props=None):
+        self.tag = tag
+        self.value = value
+        self.children = None
+        self.props = props
+
+
+def legacy_text_to_children(text):
+    # Tokenize to dict-backed TextNodes, then convert each to a dict-backed leaf
+    text_nodes = [DictTextNode(n.text, n.text_type, n.url) for n in text_to_textnodes(text)]
+    children = []
+    for node in text_nodes:
+        leaf = text_node_to_html_node(node)
+        children.append(DictLeafNode(leaf.tag, leaf.value, leaf.props))
+    return children, text_nodes
+
+
+def traced_size(func):
+    # Bytes still allocated by whatever func returns
+    tracemalloc.start()
+    result = func()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def bench_node_memory(count):
+    text = INLINE_CASES["mixed"](count)
+    before, before_size = traced_size(lambda: legacy_text_to_children(text))
+    after, after_size = traced_size(lambda: text_to_children(text))
+    nodes = len(after)
+    return {"nodes": nodes, "before_bytes_per_node": before_size / nodes, "after_bytes_per_node": after_size / nodes}
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def bench_stages(spec, basepath="/blog/", jobs=1):
+    # Run every pipeline stage on its own, over the whole synthetic site,
+    # feeding each stage the output of the previous one
+    with tempfile.TemporaryDirectory() as root:
+        paths = generate_corpus(os.path.join(root, "site"), spec)
+        pages = find_pages(paths["content"], os.path.join(root, "docs"))
+        stages = {}
+
+        def record(name, seconds, size=None):
+            stages[name] = {"seconds": seconds, "us_per_page": seconds / len(pages) * 1e6}
+            if size is not None:
+                stages[name]["bytes"] = size
+
+        def read_all():
+            texts = []
+            for from_path, _ in pages:
+                with open(from_path, encoding="utf-8") as f:
+                    texts.append(f.read())
+            return texts
+        texts, seconds = timed(read_all)
+        record("read", seconds, sum(len(text) for text in texts))
+
+        blocks, seconds = timed(lambda: [[block for block, _ in iter_blocks(text.split("\n"))] for text in texts])
+        record("block_split", seconds)
+
+        types, seconds = timed(lambda: [[block_to_block_type(block) for block in page] for page in blocks])
+        record("classify", seconds)
+
+        # Tokenizing the inline markdown, and building the block nodes around it
+        resolver = UrlResolver(basepath)
+        nodes, seconds = timed(lambda: [
+            [block_to_html(block, block_type, resolver) for block, block_type in zip(page, page_types)]
+            for page, page_types in zip(blocks, types)
+        ])
+        record("inline", seconds)
+
+        def render():
+            htmls = []
+            for page in nodes:
+                parts = ["<div>"]
+                for node in page:
+                    node.write_html(parts.append)
+                parts.append("</div>")
+                htmls.append("".join(parts))
+            return htmls
+        htmls, seconds = timed(render)
+        record("render", seconds, sum(len(html) for html in htmls))
+
+        template = load_template(paths["template"], basepath)
+        filled, seconds = timed(lambda: [template.render({"Title": "title", "Content": html}) for html in htmls])
+        record("template", seconds, sum(len(page) for page in filled))
+
+        def write_all():
+            for (_, dest_path), page in zip(pages, filled):
+                os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+                with open(dest_path, "w", encoding="utf-8") as f:
+                    f.write(page)
+        _, seconds = timed(write_all)
+        record("write", seconds)
+
+        static_dest = os.path.join(root, "static-copy")
+        with redirect_stdout(StringIO()):
+            _, seconds = timed(lambda: sync_files_recursive(paths["static"], static_dest, link="copy",
+                                                            manifest_path=os.path.join(root, "static.json")))
+        record("static_copy", seconds, spec.static_files * spec.static_bytes)
+
+        # And the real thing end to end, from a cold manifest
+        shutil.rmtree(os.path.join(root, "docs"))
+        with redirect_stdout(StringIO()):
+            _, seconds = timed(lambda: build_site(paths["content"], paths["template"], os.path.join(root, "docs"),
+                                                  basepath, os.path.join(root, "manifest.json"), jobs=jobs))
+        record("full_build", seconds)
+
+        return {"pages": len(pages), "stages": stages}
+
+
+def git_commit():
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def print_stages(results, previous=None):
+    print(f"{results['pages']} pages")
+    print(f"{'stage':<14}{'seconds':>10}{'us/page':>12}{'change':>10}")
+    for name, stage in results["stages"].items():
+        line = f"{name:<14}{stage['seconds']:>10.4f}{stage['us_per_page']:>12.1f}"
+        if previous is not None and name in previous["stages"]:
+            before = previous["stages"][name]["us_per_page"]
+            line += f"{(stage['us_per_page'] - before) / before * 100:>+9.1f}%"
+        print(line)
+
+
+def run_micro(args):
+    # A flat us/elem column as n doubles means linear scaling
+    print_inline(bench_inline(args.sizes, args.repeat, not args.no_baseline))
+
+    memory = bench_render_memory(args.sections)
+    print(f"render {memory['bytes']} byte page: peak {memory['concatenated_peak']} bytes concatenated, "
+          f"{memory['streamed_peak']} bytes streamed")
+
+    nodes = bench_node_memory(args.nodes)
+    print(f"{nodes['nodes']} inline nodes: {nodes['before_bytes_per_node']:.0f} bytes/node before, "
+          f"{nodes['after_bytes_per_node']:.0f} bytes/node after")
+
+
+def run_stages(args):
+    spec = CorpusSpec(pages=args.pages, depth=args.depth, blocks=args.blocks,
+                      link_density=args.link_density, static_files=args.static_files, seed=args.seed)
+    # Best of --repeat runs per stage, to keep the noise out of comparisons
+    results = bench_stages(spec, jobs=args.jobs)
+    for _ in range(args.repeat - 1):
+        again = bench_stages(spec, jobs=args.jobs)
+        for name, stage in again["stages"].items():
+            if stage["seconds"] < results["stages"][name]["seconds"]:
+                results["stages"][name] = stage
+    results["corpus"] = spec.to_dict()
+    results["commit"] = git_commit()
+    results["python"] = platform.python_version()
+
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+    print_stages(results, previous)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the site generator")
+    suites = parser.add_subparsers(dest="suite")
+
+    micro = suites.add_parser("micro", help="pathological inline input and memory use")
+    micro.add_argument("--sizes", type=int, nargs="+", default=[1000, 2000, 4000, 8000])
+    micro.add_argument("--repeat", type=int, default=3)
+    micro.add_argument("--sections", type=int, default=2000, help="release sections in the render memory benchmark")
+    micro.add_argument("--nodes", type=int, default=20000, help="inline elements in the node memory benchmark")
+    micro.add_argument("--no-baseline", action="store_true", help="skip the (quadratic) multipass baseline")
+
+    stages = suites.add_parser("stages", help="time every build stage on a synthetic site")
+    stages.add_argument("--pages", type=int, default=500)
+    stages.add_argument("--depth", type=int, default=3)
+    stages.add_argument("--blocks", type=int, default=20, help="blocks per page")
+    stages.add_argument("--link-density", type=float, default=0.1)
+    stages.add_argument("--static-files", type=int, default=20)
+    stages.add_argument("--seed", type=int, default=0)
+    stages.add_argument("--repeat", type=int, default=3)
+    stages.add_argument("--jobs", type=int, default=1, help="worker processes for the full build")
+    stages.add_argument("--output", help="write the results as json here")
+    stages.add_argument("--compare", help="json results of an earlier run to diff against")
+
+    args = parser.parse_args()
+    if args.suite == "micro":
+        run_micro(args)
+    else:
+        if args.suite is None:
+            args = parser.parse_args(["stages"])
+        run_stages(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
+import mmap
 from enum import Enum
-from textnode import TextNode, text_node_to_html_node
-from htmlnode import HTMLNode, ParentNode, LeafNode
-from inline import text_to_textnodes
+from textnode import make_html_node
+from htmlnode import ParentNode, LeafNode
+from inline import tokenize_inline
 
 class BlockType(Enum):
     PARAGRAPH = "paragragh"
@@ -45,19 +46,92 @@ def block_to_block_type(block):
     
 
 def markdown_to_blocks(markdown):
-    # Split the document by double newlines
-    blocks = markdown.split("\n\n")
-    filtered_blocks = []
-    
-    for block in blocks:
-        # Remove leading/trailing whitespace
-        stripped_block = block.strip()
-        
-        # Only add the block if it's not an empty string
-        if stripped_block != "":
-            filtered_blocks.append(stripped_block)
-            
-    return filtered_blocks
+    return [block for block, line_number in iter_blocks(markdown.split("\n"))]
+
+
+def iter_blocks(lines):
+    # Blocks are separated by empty lines, except inside a ``` fence, so a
+    # code sample with blank lines in it stays in one piece.
+    # lines can be any iterable (a list, an open file, iter_file_lines...),
+    # only the current block is ever held in memory.
+    # Yields (block, line number of the block's first line)
+    current = []
+    in_fence = False
+    for line_number, line in enumerate(lines, 1):
+        line = line.rstrip("\n")
+        if line == "" and not in_fence:
+            if current:
+                yield from finish_block(current)
+                current = []
+            continue
+
+        stripped = line.strip()
+        if in_fence:
+            if stripped.endswith("```"):
+                in_fence = False
+        elif stripped.startswith("```") and not any(text.strip() for _, text in current):
+            # Opening fence, unless it also closes on the same line
+            in_fence = len(stripped) < 6 or not stripped.endswith("```")
+        current.append((line_number, line))
+
+    if current:
+        yield from finish_block(current)
+
+
+def finish_block(lines):
+    # Remove leading/trailing whitespace and drop blocks that were only whitespace
+    block = "\n".join(text for _, text in lines).strip()
+    if block == "":
+        return
+    for line_number, text in lines:
+        if text.strip():
+            yield block, line_number
+            return
+
+
+def iter_typed_blocks(lines):
+    # Yields (block, BlockType, line number)
+    for block, line_number in iter_blocks(lines):
+        yield block, block_to_block_type(block), line_number
+
+
+def iter_buffer_lines(buffer):
+    # Walk a bytes-like buffer (bytes, mmap) by offsets, decoding one line at a time
+    start = 0
+    size = len(buffer)
+    while start < size:
+        end = buffer.find(b"\n", start)
+        if end == -1:
+            end = size
+        # Same newline handling as reading the file in text mode
+        line = buffer[start:end].decode("utf-8")
+        if line.endswith("\r") and end != size:
+            line = line[:-1]
+        yield from line.split("\r")
+        start = end + 1
+
+
+def iter_file_lines(path):
+    with open(path, "rb") as f:
+        try:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can't be mapped
+            return
+        with buffer:
+            yield from iter_buffer_lines(buffer)
+
+
+def write_markdown_html(typed_blocks, write, cache=None, resolver=None):
+    # The same html as markdown_to_html_node(...).write_html(write), one
+    # block at a time so the whole tree never exists at once
+    write("<div>")
+    for block, block_type, line_number in typed_blocks:
+        if cache is not None:
+            write(cache.render(block, block_type, resolver))
+        else:
+            block_to_html(block, block_type, resolver).write_html(write)
+    write("</div>")
 
 def markdown_to_html_node(markdown):
     blocks = markdown_to_blocks(markdown)
@@ -69,19 +143,18 @@ def markdown_to_html_node(markdown):
     root_div = ParentNode(tag = "div", children = child_nodes)
     return root_div
 
-def text_to_children(text):
-    text_nodes = text_to_textnodes(text)     # you already wrote this
-    children = []
-    for node in text_nodes:
-        child = text_node_to_html_node(node)   # you already wrote this too
-        children.append(child)
-    return children
+def text_to_children(text, resolver=None):
+    # Build the LeafNodes straight from the tokenizer, no TextNodes in between.
+    # A UrlResolver rewrites link and image urls as their nodes are made
+    if resolver is None:
+        return tokenize_inline(text, make_html_node)
+    return tokenize_inline(text, resolver.make_html_node)
 
-def block_to_html(block, type):
+def block_to_html(block, type, resolver=None):
     if type.value == "paragraph":
         lines = block.splitlines()
         joined = " ".join(lines)
-        children = text_to_children(joined)
+        children = text_to_children(joined, resolver)
         return ParentNode(tag = "p", children = children)
     elif type.value == "heading":
         count = 0
@@ -91,7 +164,7 @@ def block_to_html(block, type):
             else:
                 break
         head = block.lstrip("#").lstrip(" ")
-        children = text_to_children(head)
+        children = text_to_children(head, resolver)
         return ParentNode(tag = f"h{count}", children = children)
     elif type.value == "code":
         # 1. Remove the backticks by slicing
@@ -113,7 +186,7 @@ def block_to_html(block, type):
         for line in lines:
             stripped.append(line.lstrip(">").strip())
         joined = " ".join(stripped)
-        children = text_to_children(joined)
+        children = text_to_children(joined, resolver)
         return ParentNode(tag = "blockquote", children = children)
 
     elif type.value == "unordered list":
@@ -127,7 +200,7 @@ def block_to_html(block, type):
                 if line.startswith("- "):
                     stripped.append(line.removeprefix("- "))
         for text in stripped:
-            child = text_to_children(text)
+            child = text_to_children(text, resolver)
             li_node = ParentNode(tag = "li", children = child)
             li_nodes.append(li_node)
         return ParentNode(tag = "ul", children = li_nodes)
@@ -138,7 +211,7 @@ def block_to_html(block, type):
         for i, line in enumerate(lines):
             prefix = f"{i + 1}. "
             cleaned = line.removeprefix(prefix)
-            children = text_to_children(cleaned)
+            children = text_to_children(cleaned, resolver)
             li_node = ParentNode(tag = "li", children = children)
             li_nodes.append(li_node)
         return ParentNode(tag = "ol", children = li_nodes)
@@ -146,7 +219,7 @@ def block_to_html(block, type):
     else:
         lines = block.splitlines()
         joined = " ".join(lines)
-        children = text_to_children(joined)
+        children = text_to_children(joined, resolver)
         return ParentNode(tag = "p", children = children)
         
 
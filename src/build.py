@@ -0,0 +1,91 @@
+import os
+from manifest import BuildManifest, RENDERER_VERSION, hash_file, make_build_key
+from page_generator import generate_pages_recursive, BuildError
+from template import load_template
+from metadata import SiteIndex, uses_site_index
+import render_cache
+
+MANIFEST_PATH = "./.cache/build-manifest.json"
+# Where the search index goes, inside the output directory
+SEARCH_DIR = "search"
+
+
+def site_build_key(template_path, basepath, dest_dir_path, assets=None, minify=False):
+    # The template and every partial it includes affect all pages, and so
+    # do the static files it links to. Those the pages link to are tracked
+    # per page, in the manifest
+    template = load_template(template_path, basepath, assets)
+    return make_build_key(
+        RENDERER_VERSION,
+        basepath,
+        os.path.abspath(dest_dir_path),
+        "assets" if assets is not None else "",
+        "minify" if minify else "",
+        *[hash_file(path) for path, _ in template.dependencies],
+        *[f"{site_path}={file_hash}" for site_path, file_hash in template.asset_hashes],
+    )
+
+
+def write_search_index(search, from_paths, dest_dir_path):
+    # Pages that are gone drop out of the index, only changed shards are written
+    search.retain(from_paths)
+    changed = search.write(os.path.join(dest_dir_path, SEARCH_DIR))
+    search.save()
+    print(f"Search index: {len(search.pages)} pages, {changed} files updated")
+
+
+def build_site(dir_path_content, template_path, dest_dir_path, basepath, manifest_path=MANIFEST_PATH, force=False, jobs=1,
+               profiler=None, verbose=False, manifest=None, block_cache=None, assets=None, io_threads=0,
+               search=None, shard=None, minify=False, site_index=None):
+    # assets is an AssetManifest when static files are fingerprinted,
+    # search a SearchIndex to update and write into dest_dir_path/search/,
+    # shard an (i, N) pair when only the i-th of N shares of pages is built,
+    # minify strips the pages of insignificant whitespace.
+    # Long-running callers (serve) pass in the manifest and site index they
+    # keep in memory; otherwise the site index is loaded from .cache/. It's
+    # only used when the template has slots that query it.
+    if manifest is None:
+        manifest = BuildManifest.load(manifest_path)
+    manifest.seen = set()
+    manifest.set_build_key(site_build_key(template_path, basepath, dest_dir_path, assets, minify))
+    if force:
+        manifest.dirty = True
+    if not uses_site_index(load_template(template_path, basepath, assets, minify)):
+        site_index = None
+    elif site_index is None:
+        site_index = SiteIndex.load()
+
+    render_cache.set_block_cache(block_cache)
+    try:
+        generated, written = generate_pages_recursive(dir_path_content, template_path, dest_dir_path, basepath,
+                                                      manifest, jobs, profiler, verbose, assets, io_threads, search,
+                                                      shard, minify, site_index)
+    except BuildError:
+        # Keep the pages that did build so only the broken ones are retried
+        manifest.dirty = False
+        manifest.prune()
+        manifest.save()
+        if search is not None:
+            write_search_index(search, manifest.seen, dest_dir_path)
+        raise
+    finally:
+        if site_index is not None:
+            site_index.save()
+        render_cache.set_block_cache(None)
+        if block_cache is not None:
+            block_cache.save()
+            print(f"Block cache: {block_cache.hits} hits, {block_cache.misses} misses "
+                  f"({block_cache.hit_rate():.0%} hit rate)")
+    manifest.dirty = False
+    total = len(manifest.seen)
+    removed = manifest.prune()
+    manifest.save()
+    if search is not None:
+        write_search_index(search, manifest.seen, dest_dir_path)
+
+    for dest_path in removed:
+        print(f"Removed stale page {dest_path}")
+    # Rendered pages whose html came out the same weren't rewritten
+    print(f"Generated {generated} pages ({written} written, {generated - written} identical), "
+          f"{total - generated} unchanged, {len(removed)} removed")
+    return generated
@@ -0,0 +1,176 @@
+import argparse
+import posixpath
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from block import BlockType, iter_typed_blocks
+from document import heading_level, split_front_matter
+from inline import DelimiterError, tokenize_inline
+from page_generator import iter_pages, pool_size
+from template import load_template
+from textnode import TextType
+from urls import UrlResolver, site_path
+import urls
+
+# Link url (with the page's directory, for relative ones) -> whether it's
+# broken, per process: most pages link to the same few places
+checked_links = {}
+
+
+def init_checker(site_resolver):
+    urls.set_site_resolver(site_resolver)
+    checked_links.clear()
+
+
+def has_inline_markup(text):
+    # Without any of these the inline parser can't fail or find a link
+    return "`" in text or "*" in text or "_" in text or "[" in text
+
+
+def inline_lines(block, block_type):
+    # The lines of a block as block_to_html hands them to the inline parser,
+    # with the block's own markup stripped, and whether they are parsed as
+    # one text joined by spaces (paragraphs, quotes) or one by one (list items)
+    lines = block.splitlines()
+    if block_type == BlockType.CODE:
+        return [], False
+    if block_type == BlockType.HEADING:
+        return [block.lstrip("#").lstrip(" ")], False
+    if block_type == BlockType.QUOTE:
+        return [line.lstrip(">").strip() for line in lines], True
+    if block_type == BlockType.UNORDERED_LIST:
+        return [line[2:] for line in lines], False
+    if block_type == BlockType.ORDERED_LIST:
+        return [line.removeprefix(f"{i + 1}. ") for i, line in enumerate(lines)], False
+    return lines, True
+
+
+def line_of(lines, position):
+    # Which of lines, joined by single spaces, position falls on
+    for index, line in enumerate(lines):
+        position -= len(line) + 1
+        if position < 0:
+            return index
+    return len(lines) - 1
+
+
+def check_block(block, block_type, line_number, resolver, problems):
+    # Runs the inline parser over the block without making any nodes, and
+    # checks its links. problems gets (line number, message) pairs
+    lines, joined = inline_lines(block, block_type)
+    texts = [" ".join(lines)] if joined else lines
+    for index, text in enumerate(texts):
+        if not has_inline_markup(text):
+            continue
+        links = []
+        make_node = lambda text, text_type, url=None: links.append(url) if text_type == TextType.LINK else None
+        # After an unclosed delimiter, carry on just past it for the next one
+        position = 0
+        while True:
+            try:
+                tokenize_inline(text[position:] if position else text, make_node)
+                break
+            except DelimiterError as e:
+                error = position + e.position
+                problems.append((line_number + (line_of(lines, error) if joined else index), str(e)))
+                position = error + 1
+        if resolver is None:
+            continue
+        for url in links:
+            if is_broken(url, resolver):
+                offset = index
+                if joined:
+                    offset = next((i for i, line in enumerate(lines) if f"]({url})" in line), 0)
+                problems.append((line_number + offset, f"broken link {url}"))
+
+
+def is_broken(url, resolver):
+    key = url if url.startswith("/") else posixpath.dirname(resolver.page) + "/" + url
+    broken = checked_links.get(key)
+    if broken is None:
+        count = len(resolver.broken)
+        resolver.check(url)
+        broken = checked_links[key] = len(resolver.broken) > count
+    return broken
+
+
+def check_page(page):
+    # Everything that would stop this page from building, or break its
+    # links, without rendering it: (from_path, [(line number, message)]).
+    # The line number is None for problems with the page as a whole.
+    from_path, dest_path = page
+    resolver = None
+    if urls.site_resolver is not None:
+        resolver = urls.site_resolver.for_page(dest_path)
+    problems = []
+    has_title = False
+    try:
+        with open(from_path, "r", encoding="utf-8") as f:
+            meta, lines = split_front_matter(f)
+            for block, block_type, line_number in iter_typed_blocks(lines):
+                if block_type == BlockType.HEADING and heading_level(block) == 1:
+                    has_title = True
+                check_block(block, block_type, line_number, resolver, problems)
+    except (OSError, UnicodeDecodeError) as e:
+        return from_path, [(None, f"{type(e).__name__}: {e}")]
+    if not has_title:
+        problems.insert(0, (None, "no header found"))
+    return from_path, problems
+
+
+def check_pages(pages, jobs=0):
+    # Yields check_page results in page order, from a pool of worker processes
+    workers = pool_size(jobs, len(pages))
+    if workers == 1:
+        yield from map(check_page, pages)
+        return
+    chunksize = max(1, len(pages) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_checker,
+                             initargs=(urls.site_resolver,)) as executor:
+        yield from executor.map(check_page, pages, chunksize=chunksize)
+
+
+def check_site(dir_path_content, template_path, dest_dir_path, basepath="/", jobs=0):
+    # Checks the template and every page of the site, writing nothing.
+    # Returns how many pages were checked and every problem found, as
+    # (path, line number or None, message), in page and line order
+    problems = []
+    try:
+        load_template(template_path, basepath)
+    except (OSError, ValueError) as e:
+        problems.append((template_path, None, f"{type(e).__name__}: {e}"))
+
+    pages = list(iter_pages(dir_path_content, dest_dir_path))
+    targets = set(site_path(dest_path, dest_dir_path) for _, dest_path in pages)
+    init_checker(UrlResolver(basepath, dest_dir_path, targets))
+    try:
+        for from_path, page_problems in check_pages(pages, jobs):
+            problems.extend((from_path, line_number, message) for line_number, message in page_problems)
+    finally:
+        init_checker(None)
+    return len(pages), problems
+
+
+def format_problem(path, line_number, message):
+    # path:line: message, the way compilers and editors expect it
+    if line_number is None:
+        return f"{path}: {message}"
+    return f"{path}:{line_number}: {message}"
+
+
+def check_main(argv, dir_path_content, template_path, dest_dir_path):
+    parser = argparse.ArgumentParser(prog="main.py check",
+                                     description="Check every page parses and links resolve, without writing anything")
+    parser.add_argument("basepath", nargs="?", default="/")
+    parser.add_argument("--jobs", "-j", type=int, default=0, help="number of worker processes (default: one per core)")
+    args = parser.parse_args(argv)
+    start = time.perf_counter()
+    checked, problems = check_site(dir_path_content, template_path, dest_dir_path, args.basepath, args.jobs)
+    for problem in problems:
+        print(format_problem(*problem), file=sys.stderr)
+    paths = len(set(path for path, _, _ in problems))
+    print(f"Checked {checked} pages in {time.perf_counter() - start:.2f}s: "
+          f"{len(problems)} problem(s) in {paths} file(s)")
+    if problems:
+        sys.exit(1)
@@ -1,28 +1,138 @@
 import os
 import shutil
+import json
+from manifest import hash_file
+from profiler import Progress
+from walk import walk_tree
 
-def copy_files_recursive(src, dst):
-    # 1. Ensure we have the full paths
+STATIC_MANIFEST_PATH = "./.cache/static-manifest.json"
+
+# ioctl request number for FICLONE (copy-on-write clone) on Linux
+FICLONE = 0x40049409
+
+
+def reflink(src, dst):
+    # Only works on copy-on-write filesystems (btrfs, xfs, apfs...)
+    import fcntl
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+def place_file(src, dst, link="auto"):
+    # Write next to the destination and rename over it, so a hardlinked
+    # destination never gets written through to the source file
+    tmp_path = dst + ".tmp"
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+
+    if link == "hardlink":
+        try:
+            os.link(src, tmp_path)
+            os.replace(tmp_path, dst)
+            return
+        except OSError:
+            pass
+    if link in ("auto", "reflink"):
+        try:
+            reflink(src, tmp_path)
+            shutil.copystat(src, tmp_path)
+            os.replace(tmp_path, dst)
+            return
+        except (OSError, ImportError):
+            if os.path.lexists(tmp_path):
+                os.remove(tmp_path)
+
+    shutil.copy2(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+
+def is_unchanged(src, dst, checksum=False):
+    # src can be a path or a DirEntry, whose stat() is cached
+    try:
+        dst_stat = os.stat(dst)
+    except FileNotFoundError:
+        return False
+    src_stat = src.stat() if isinstance(src, os.DirEntry) else os.stat(src)
+    if src_stat.st_size != dst_stat.st_size:
+        return False
+    if src_stat.st_mtime_ns == dst_stat.st_mtime_ns:
+        return True
+    # Same size but different mtime: only the content can tell
+    return checksum and hash_file(src) == hash_file(dst)
+
+
+def sync_dir(source, destination, synced, stats, checksum, link, progress, names=None):
+    os.makedirs(destination, exist_ok=True)
+    for entry, relpath in walk_tree(source, dirs=True):
+        item_dest_path = os.path.join(destination, relpath)
+        if entry.is_dir():
+            os.makedirs(item_dest_path, exist_ok=True)
+            continue
+        # Fingerprinted assets are placed under their new name
+        if names is not None and relpath in names:
+            item_dest_path = os.path.join(os.path.dirname(item_dest_path), os.path.basename(names[relpath]))
+            relpath = names[relpath]
+        synced.add(relpath)
+        if is_unchanged(entry, item_dest_path, checksum):
+            stats["unchanged"] += 1
+            continue
+        place_file(entry.path, item_dest_path, link)
+        progress.update(f"Copying: {entry.path} -> {item_dest_path}")
+        stats["copied"] += 1
+        stats["bytes"] += entry.stat().st_size
+
+
+def load_synced(manifest_path):
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return set(json.load(f))
+    except (OSError, ValueError):
+        return set()
+
+
+def save_synced(manifest_path, synced):
+    directory = os.path.dirname(manifest_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(sorted(synced), f)
+    os.replace(tmp_path, manifest_path)
+
+
+def remove_empty_dirs(directory, stop):
+    while directory != stop and directory.startswith(stop):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            return
+        directory = os.path.dirname(directory)
+
+
+def sync_files_recursive(src, dst, checksum=False, link="auto", manifest_path=STATIC_MANIFEST_PATH, verbose=False,
+                         names=None):
+    # Leaves the generated pages alone and only touches files that
+    # actually changed, so their mtimes stay stable.
+    # names maps a file's path in src to a different path in dst
     source = os.path.abspath(src)
     destination = os.path.abspath(dst)
 
-    # 2. If it's the first call, we usually want to clear the destination
-    # Note: Moving rmtree OUTSIDE the loop is vital so you don't delete 
-    # the folder you just started copying into!
-    if os.path.exists(destination):
-        shutil.rmtree(destination)
-    os.mkdir(destination)
-
-    # 3. Iterate through the source
-    for item in os.listdir(source):
-        # Create full paths for the current item
-        item_source_path = os.path.join(source, item)
-        item_dest_path = os.path.join(destination, item)
-
-        print(f"Copying: {item_source_path} -> {item_dest_path}")
-
-        if os.path.isfile(item_source_path):
-            shutil.copy(item_source_path, item_dest_path)
-        elif os.path.isdir(item_source_path):
-            # Recursively call the function for the sub-directory
-            copy_files_recursive(item_source_path, item_dest_path)
+    previous = load_synced(manifest_path)
+    synced = set()
+    stats = {"copied": 0, "unchanged": 0, "removed": 0, "bytes": 0}
+    progress = Progress("Copying static files", verbose=verbose)
+    sync_dir(source, destination, synced, stats, checksum, link, progress, names)
+    progress.finish()
+
+    # Only delete files we copied in an earlier sync, never generated pages
+    for relpath in sorted(previous - synced):
+        stale_path = os.path.join(destination, relpath)
+        if os.path.isfile(stale_path):
+            if verbose:
+                print(f"Removing: {stale_path}")
+            os.remove(stale_path)
+            stats["removed"] += 1
+            remove_empty_dirs(os.path.dirname(stale_path), destination)
+
+    save_synced(manifest_path, synced)
+    return stats
@@ -0,0 +1,148 @@
+import argparse
+import os
+import random
+
+# Synthetic sites for benchmarking: a content/ tree, a static/ tree and a
+# template.html laid out exactly like the real site
+
+TEMPLATE = """<!doctype html>
+<html>
+
+<head>
+    <meta charset="utf-8" />
+    <meta name="viewport" content="width=device-width, initial-scale=1" />
+    <title>{{ Title }}</title>
+    <link href="/index.css" rel="stylesheet" />
+</head>
+
+<body>
+    <article>{{ Content }}</article>
+</body>
+
+</html>"""
+
+WORDS = (
+    "the ring of power was forged in the fires of mount doom by sauron who "
+    "sought to rule all the free peoples of middle earth elves dwarves and men "
+    "alike while hobbits lived quietly in the shire far from such troubles"
+).split()
+
+# Relative weight of each block kind on a page
+DEFAULT_MIX = {"paragraph": 6, "list": 2, "ordered": 1, "code": 1, "quote": 1, "heading": 2}
+
+
+class CorpusSpec:
+    def __init__(self, pages=200, depth=3, blocks=20, mix=None, link_density=0.1,
+                 static_files=20, static_bytes=64 * 1024, seed=0):
+        self.pages = pages
+        # How many directory levels pages are nested in
+        self.depth = depth
+        # Blocks per page (on average)
+        self.blocks = blocks
+        self.mix = mix if mix is not None else dict(DEFAULT_MIX)
+        # Chance that any given word turns into a link
+        self.link_density = link_density
+        self.static_files = static_files
+        self.static_bytes = static_bytes
+        self.seed = seed
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+def make_sentence(rng, spec, words=12):
+    parts = []
+    for i in range(words):
+        word = rng.choice(WORDS)
+        roll = rng.random()
+        if roll < spec.link_density:
+            parts.append(f"[{word}](/{rng.choice(WORDS)}/{i})")
+        elif roll < spec.link_density + 0.05:
+            parts.append(f"**{word}**")
+        elif roll < spec.link_density + 0.08:
+            parts.append(f"_{word}_")
+        elif roll < spec.link_density + 0.10:
+            parts.append(f"`{word}`")
+        else:
+            parts.append(word)
+    return " ".join(parts).capitalize() + "."
+
+
+def make_block(rng, spec, kind):
+    if kind == "paragraph":
+        return "\n".join(make_sentence(rng, spec) for _ in range(rng.randint(1, 4)))
+    if kind == "list":
+        return "\n".join(f"- {make_sentence(rng, spec, 6)}" for _ in range(rng.randint(2, 6)))
+    if kind == "ordered":
+        return "\n".join(f"{i}. {make_sentence(rng, spec, 6)}" for i in range(1, rng.randint(3, 7)))
+    if kind == "code":
+        lines = [f"    {' '.join(rng.choices(WORDS, k=5))}()" for _ in range(rng.randint(2, 12))]
+        return "```\n" + "\n".join(lines) + "\n```"
+    if kind == "quote":
+        return "\n".join(f"> {make_sentence(rng, spec, 8)}" for _ in range(rng.randint(1, 3)))
+    if kind == "heading":
+        return "#" * rng.randint(2, 4) + " " + make_sentence(rng, spec, 4)
+    raise ValueError(f"unknown block kind {kind}")
+
+
+def make_page(rng, spec):
+    kinds = list(spec.mix)
+    weights = [spec.mix[kind] for kind in kinds]
+    blocks = [f"# {make_sentence(rng, spec, 5)}"]
+    if rng.random() < 0.3:
+        blocks.append(f"![{rng.choice(WORDS)}](/images/{rng.randrange(max(spec.static_files, 1))}.png)")
+    for kind in rng.choices(kinds, weights, k=max(1, int(rng.gauss(spec.blocks, spec.blocks / 4)))):
+        blocks.append(make_block(rng, spec, kind))
+    return "\n\n".join(blocks) + "\n"
+
+
+def page_path(rng, spec, index):
+    parts = [f"section{rng.randrange(4)}" for _ in range(rng.randint(0, spec.depth))]
+    return os.path.join(*parts, f"page{index}", "index.md")
+
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    mode = "wb" if isinstance(data, bytes) else "w"
+    with open(path, mode) as f:
+        f.write(data)
+
+
+def generate_corpus(root, spec):
+    # Deterministic for a given spec, so two commits benchmark the same site
+    rng = random.Random(spec.seed)
+    content = os.path.join(root, "content")
+    static = os.path.join(root, "static")
+
+    write_file(os.path.join(root, "template.html"), TEMPLATE)
+    write_file(os.path.join(content, "index.md"), make_page(rng, spec))
+    for index in range(1, spec.pages):
+        write_file(os.path.join(content, page_path(rng, spec, index)), make_page(rng, spec))
+
+    write_file(os.path.join(static, "index.css"), "body { margin: 0 auto; max-width: 40em; }\n")
+    for index in range(spec.static_files):
+        write_file(os.path.join(static, "images", f"{index}.png"), rng.randbytes(spec.static_bytes))
+
+    return {
+        "content": content,
+        "static": static,
+        "template": os.path.join(root, "template.html"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic site for benchmarking")
+    parser.add_argument("root")
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--blocks", type=int, default=20)
+    parser.add_argument("--link-density", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    spec = CorpusSpec(pages=args.pages, depth=args.depth, blocks=args.blocks,
+                      link_density=args.link_density, seed=args.seed)
+    generate_corpus(args.root, spec)
+
+
+if __name__ == "__main__":
+    main()
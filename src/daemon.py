@@ -0,0 +1,176 @@
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from build import MANIFEST_PATH
+from devserver import DevServer
+from document import parse_document
+from metadata import uses_site_index
+from minify import minify_html
+from page_generator import BuildError, page_dest_path, template_values
+from template import load_template
+from urls import UrlResolver
+
+
+class BuildDaemon(DevServer):
+    # A DevServer without the file watching: the warm state (manifest,
+    # compiled template, block cache, parsed documents) is driven through
+    # a local HTTP API instead, so previews don't pay for a new process
+    def __init__(self, dir_path_content, dir_path_static, template_path, dest_dir_path, basepath="/",
+                 manifest_path=MANIFEST_PATH, minify=False):
+        super().__init__(dir_path_content, dir_path_static, template_path, dest_dir_path, basepath, manifest_path,
+                         minify)
+        # abspath -> (mtime_ns, size, Document)
+        self.documents = {}
+        # Renders and builds share the caches, so they take turns
+        self.lock = threading.Lock()
+
+    def source_path(self, path, roots=None):
+        # A path from an API caller (relative to the working directory, or
+        # absolute) named the way the build and the watcher name it:
+        # ./content/blog/tom/index.md. Anything outside roots is refused
+        if roots is None:
+            roots = [self.dir_path_content]
+        absolute = os.path.abspath(path)
+        for root in roots:
+            if absolute.startswith(os.path.join(os.path.abspath(root), "")):
+                return os.path.join(root, os.path.relpath(absolute, os.path.abspath(root)))
+        raise ValueError(f"{path} is not in {' or '.join(roots)}")
+
+    def document(self, from_path):
+        path = os.path.abspath(self.source_path(from_path))
+        stat = os.stat(path)
+        cached = self.documents.get(path)
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        with open(path, "r", encoding="utf-8") as f:
+            document = parse_document(f.read())
+        self.documents[path] = (stat.st_mtime_ns, stat.st_size, document)
+        return document
+
+    def render_document(self, document, with_template=True, from_path=None):
+        # Rendered with the same resolver, template and slot values as
+        # generate_page gives it, as the page at from_path when there is one
+        resolver = UrlResolver(self.basepath, self.dest_dir_path)
+        if from_path is not None:
+            resolver = resolver.for_page(page_dest_path(from_path, self.dir_path_content, self.dest_dir_path))
+        content = lambda write: document.write_html(write, self.block_cache, resolver)
+        if not with_template:
+            parts = []
+            content(parts.append)
+            return "".join(parts)
+        template = load_template(self.template_path, self.basepath, minify=self.minify)
+        site_values = None
+        # Pages the last build hasn't seen yet aren't in the index
+        if from_path is not None and uses_site_index(template) and from_path in self.site_index.pages:
+            site_values = self.site_index.page_values(template, from_path, self.basepath)
+        html = template.render(template_values(document.title, content, document.meta, site_values))
+        return minify_html(html) if self.minify else html
+
+    def render_path(self, from_path):
+        # The page as it would be built, without writing it
+        with self.lock:
+            document = self.document(from_path)
+            # Named the way the build names it, which the site index goes by
+            from_path = self.source_path(from_path)
+            return {"title": document.title, "html": self.render_document(document, from_path=from_path)}
+
+    def render_markdown(self, markdown, with_template=False):
+        with self.lock:
+            document = parse_document(markdown)
+            result = {"html": self.render_document(document, with_template)}
+            if with_template:
+                result["title"] = document.title
+            return result
+
+    def rebuild_paths(self, changed, removed):
+        # With no paths, an incremental build of the whole site. Returns the
+        # pages that were rendered again
+        with self.lock:
+            roots = [self.dir_path_content, self.dir_path_static]
+            template_paths = set(self.template_paths())
+            # Checked before anything is rebuilt, so a bad path changes nothing
+            changed, removed = ({path if os.path.abspath(path) in template_paths else self.source_path(path, roots)
+                                 for path in paths} for paths in (changed, removed))
+            for path in removed:
+                self.documents.pop(os.path.abspath(path), None)
+            if not changed and not removed:
+                pages = self.build_all()
+            else:
+                pages = self.rebuild(changed, removed)
+            return {"pages": pages}
+
+
+def make_api_handler(daemon):
+    routes = {
+        "/render": lambda body: daemon.render_path(body["path"]),
+        "/render-markdown": lambda body: daemon.render_markdown(body["markdown"], body.get("template", False)),
+        "/rebuild": lambda body: daemon.rebuild_paths(body.get("changed", []), body.get("removed", [])),
+    }
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/health":
+                self.send_json(200, {"ok": True, "pages": len(daemon.manifest.pages)})
+            else:
+                self.send_json(404, {"error": f"unknown endpoint {self.path}"})
+
+        def do_POST(self):
+            route = routes.get(self.path)
+            if route is None:
+                self.send_json(404, {"error": f"unknown endpoint {self.path}"})
+                return
+            start = time.perf_counter()
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                result = route(body)
+            except (ValueError, KeyError, OSError, BuildError) as e:
+                self.send_json(400, {"error": f"{type(e).__name__}: {e}"})
+                return
+            except Exception as e:
+                # A page that doesn't render is the caller's problem, not the daemon's
+                self.send_json(422, {"error": f"{type(e).__name__}: {e}"})
+                return
+            result["ms"] = round((time.perf_counter() - start) * 1000, 3)
+            self.send_json(200, result)
+
+        def send_json(self, status, data):
+            body = json.dumps(data).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def daemon_main(argv, dir_path_content, dir_path_static, template_path, dest_dir_path):
+    parser = argparse.ArgumentParser(prog="main.py daemon",
+                                     description="Keep the build warm and serve a local render API")
+    parser.add_argument("--port", type=int, default=8899)
+    parser.add_argument("--host", default="127.0.0.1", help="only bind to other interfaces on a trusted network")
+    parser.add_argument("--basepath", default="/")
+    parser.add_argument("--minify", action="store_true", help="strip insignificant whitespace from the pages")
+    args = parser.parse_args(argv)
+    daemon = BuildDaemon(dir_path_content, dir_path_static, template_path, dest_dir_path, args.basepath,
+                         minify=args.minify)
+    daemon.build_all()
+    server = ThreadingHTTPServer((args.host, args.port), make_api_handler(daemon))
+    server.daemon_threads = True
+    print(f"Render API on http://{args.host}:{args.port} "
+          "(GET /health, POST /render, /render-markdown, /rebuild)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        daemon.manifest.save()
@@ -0,0 +1,419 @@
+import argparse
+import os
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from build import build_site, MANIFEST_PATH
+from copystatic import sync_files_recursive
+from manifest import BuildManifest
+from page_generator import generate_page, page_dest_path, BuildError, PAGE_EXTENSION
+from template import load_template
+from metadata import SiteIndex, uses_site_index
+from render_cache import BlockCache
+from walk import walk_tree
+import render_cache
+
+try:
+    from watchdog.observers import Observer
+except ImportError:
+    # Without watchdog the watched trees are polled
+    Observer = None
+
+LIVERELOAD_PATH = "/__livereload"
+# Injected into html responses by the server only, never into docs/
+LIVERELOAD_SCRIPT = (
+    '<script>new EventSource("' + LIVERELOAD_PATH + '").onmessage = '
+    'function () { location.reload(); };</script>'
+)
+# Idle watching backs off from --interval up to this, in seconds
+MAX_WATCH_INTERVAL = 1.0
+
+
+def snapshot(paths):
+    # path -> (mtime, size) for every file in the given files and directories
+    files = {}
+    for path in paths:
+        try:
+            for entry, relpath in walk_tree(path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # Deleted while we were looking
+                    continue
+                files[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        except NotADirectoryError:
+            stat = os.stat(path)
+            files[path] = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            pass
+    return files
+
+
+def diff_snapshots(old, new):
+    changed = {path for path, state in new.items() if old.get(path) != state}
+    removed = set(old) - set(new)
+    return changed, removed
+
+
+class PollingWatcher:
+    # Keeps a snapshot() of paths up to date, cheaper than taking it again:
+    # a directory is only listed again when its mtime moved, which it does
+    # when entries are added, removed or renamed. Its files are still
+    # stat'ed every time, since writing one in place leaves the directory alone
+    def __init__(self, paths):
+        self.paths = paths
+        # directory -> (mtime, files, subdirectories) as last listed
+        self.listings = {}
+        self.files = self.scan()
+
+    def listing(self, directory):
+        mtime = os.stat(directory).st_mtime_ns
+        listing = self.listings.get(directory)
+        if listing is None or listing[0] != mtime:
+            files = []
+            subdirs = []
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        subdirs.append(entry.path)
+                    elif entry.is_file():
+                        files.append(entry.path)
+            listing = self.listings[directory] = (mtime, files, subdirs)
+        return listing
+
+    def scan(self):
+        files = {}
+        listed = set()
+        stack = []
+        for path in self.paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if os.path.isdir(path):
+                stack.append(path)
+            else:
+                files[path] = (stat.st_mtime_ns, stat.st_size)
+        while stack:
+            directory = stack.pop()
+            try:
+                _, names, subdirs = self.listing(directory)
+            except (FileNotFoundError, NotADirectoryError):
+                # Removed since its parent was listed
+                continue
+            listed.add(directory)
+            stack.extend(subdirs)
+            for path in names:
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files[path] = (stat.st_mtime_ns, stat.st_size)
+        for directory in set(self.listings) - listed:
+            del self.listings[directory]
+        return files
+
+    def poll(self):
+        # (changed, removed) since the last poll
+        files = self.scan()
+        changed, removed = diff_snapshots(self.files, files)
+        self.files = files
+        return changed, removed
+
+    def close(self):
+        pass
+
+
+class EventWatcher:
+    # The same as PollingWatcher, from watchdog's file system events: only
+    # what they name is looked at again, and nothing at all while idle
+    def __init__(self, paths):
+        self.paths = paths
+        self.files = snapshot(paths)
+        self.lock = threading.Lock()
+        self.events = set()
+        # Event paths are matched by absolute path (some platforms report
+        # them that way) and named back the way snapshot() names them. A
+        # single file (the template) can only be watched through its directory
+        self.roots = {os.path.abspath(path): path for path in paths if os.path.isdir(path)}
+        self.single_files = {os.path.abspath(path): path for path in paths if not os.path.isdir(path)}
+        self.observer = Observer()
+        for root in self.roots:
+            self.observer.schedule(self, root, recursive=True)
+        for directory in set(os.path.dirname(path) for path in self.single_files):
+            self.observer.schedule(self, directory)
+        self.observer.start()
+
+    def dispatch(self, event):
+        # Called by watchdog's thread. A directory is "modified" whenever an
+        # entry in it is, and that entry gets its own event
+        if event.is_directory and event.event_type == "modified":
+            return
+        with self.lock:
+            for path in (event.src_path, getattr(event, "dest_path", "")):
+                if path:
+                    self.events.add(path)
+
+    def watched_name(self, path):
+        # The name snapshot() gives path, None for the neighbours of a single file
+        path = os.path.abspath(path)
+        if path in self.single_files:
+            return self.single_files[path]
+        for root, name in self.roots.items():
+            if path == root:
+                return name
+            if path.startswith(os.path.join(root, "")):
+                return os.path.join(name, os.path.relpath(path, root))
+        return None
+
+    def poll(self):
+        with self.lock:
+            events, self.events = self.events, set()
+        changed = set()
+        removed = set()
+        for path in events:
+            path = self.watched_name(path)
+            if path is None:
+                continue
+            if os.path.isdir(path) or path not in self.files and not os.path.exists(path):
+                # A directory created, moved or deleted: everything below it
+                prefix = os.path.join(path, "")
+                old = {p: state for p, state in self.files.items() if p.startswith(prefix)}
+                new = snapshot([path]) if os.path.isdir(path) else {}
+            else:
+                old = {path: self.files[path]} if path in self.files else {}
+                new = snapshot([path]) if os.path.exists(path) else {}
+            path_changed, path_removed = diff_snapshots(old, new)
+            changed |= path_changed
+            removed |= path_removed
+            for p in path_removed:
+                del self.files[p]
+            self.files.update(new)
+        return changed, removed
+
+    def close(self):
+        self.observer.stop()
+        self.observer.join()
+
+
+def make_watcher(paths):
+    return EventWatcher(paths) if Observer is not None else PollingWatcher(paths)
+
+
+class Reloader:
+    # Open browsers wait on this and reload when the version moves
+    def __init__(self):
+        self.version = 0
+        self.condition = threading.Condition()
+
+    def notify(self):
+        with self.condition:
+            self.version += 1
+            self.condition.notify_all()
+
+    def wait(self, version, timeout):
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+
+def make_handler(directory, reloader, basepath="/"):
+    # docs/ is served under the basepath, where the pages' links expect it
+    prefix = basepath.rstrip("/")
+
+    class Handler(SimpleHTTPRequestHandler):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, directory=directory, **kwargs)
+
+        def do_GET(self):
+            if self.path == LIVERELOAD_PATH:
+                self.stream_reloads()
+                return
+            path = self.path.split("?")[0]
+            if path != prefix and not path.startswith(prefix + "/"):
+                self.send_error(404)
+                return
+            path = self.translate_path(self.path)
+            if self.path.split("?")[0].endswith("/"):
+                path = os.path.join(path, "index.html")
+            if path.endswith(".html") and os.path.isfile(path):
+                self.send_html(path)
+                return
+            super().do_GET()
+
+        def translate_path(self, path):
+            return super().translate_path(path[len(prefix):])
+
+        def send_html(self, path):
+            with open(path, "rb") as f:
+                body = f.read()
+            script = LIVERELOAD_SCRIPT.encode("utf-8")
+            index = body.rfind(b"</body>")
+            body = body + script if index == -1 else body[:index] + script + body[index:]
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Cache-Control", "no-store")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def stream_reloads(self):
+            # Server-sent events: one "reload" message per finished rebuild
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-store")
+            self.end_headers()
+            version = reloader.version
+            try:
+                while True:
+                    latest = reloader.wait(version, 15)
+                    if latest != version:
+                        version = latest
+                        self.wfile.write(b"data: reload\n\n")
+                    else:
+                        self.wfile.write(b": ping\n\n")
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                return
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class DevServer:
+    def __init__(self, dir_path_content, dir_path_static, template_path, dest_dir_path, basepath="/",
+                 manifest_path=MANIFEST_PATH, minify=False):
+        self.dir_path_content = dir_path_content
+        self.dir_path_static = dir_path_static
+        self.template_path = template_path
+        self.dest_dir_path = dest_dir_path
+        self.basepath = basepath
+        self.minify = minify
+        self.manifest = BuildManifest.load(manifest_path)
+        # Rendered blocks stay warm between rebuilds
+        self.block_cache = BlockCache()
+        # Kept next to the manifest, which is where the build keeps it too
+        self.site_index = SiteIndex.load(os.path.join(os.path.dirname(manifest_path), "site-index.json"))
+        self.reloader = Reloader()
+
+    def template_paths(self):
+        return [path for path, _ in load_template(self.template_path, self.basepath).dependencies]
+
+    def watched_paths(self):
+        return [self.dir_path_content, self.dir_path_static] + self.template_paths()
+
+    def build_all(self):
+        # Returns the pages the build rendered: the manifest records a new
+        # entry for those, and keeps the old one for pages it skipped
+        sync_files_recursive(self.dir_path_static, self.dest_dir_path)
+        before = dict(self.manifest.pages)
+        try:
+            build_site(self.dir_path_content, self.template_path, self.dest_dir_path, self.basepath,
+                       manifest=self.manifest, block_cache=self.block_cache, site_index=self.site_index,
+                       minify=self.minify)
+        except BuildError as e:
+            print(e)
+        return sorted(path for path, entry in self.manifest.pages.items() if before.get(path) is not entry)
+
+    def rebuild(self, changed, removed):
+        # Only redo what the changes touch: one page per edited markdown file,
+        # a static sync for assets, every page when the template changes.
+        # Paths are named the way snapshot() names them. Returns the pages
+        # that were rendered again.
+        paths = changed | removed
+        template_paths = set(self.template_paths())
+        if any(os.path.abspath(path) in template_paths for path in paths):
+            return self.build_all()
+
+        content_root = os.path.join(self.dir_path_content, "")
+        pages = [path for path in paths if path.startswith(content_root) and path.endswith(PAGE_EXTENSION)]
+        if pages and uses_site_index(load_template(self.template_path, self.basepath)):
+            # An edit can show on the pages that list it too: the manifest
+            # knows which ones, and the rest are skipped
+            return self.build_all()
+
+        static_root = os.path.join(self.dir_path_static, "")
+        if any(path.startswith(static_root) for path in paths):
+            sync_files_recursive(self.dir_path_static, self.dest_dir_path)
+
+        rebuilt = []
+        for path in sorted(pages):
+            dest_path = page_dest_path(path, self.dir_path_content, self.dest_dir_path)
+            if path in removed:
+                self.manifest.forget(path)
+                if os.path.exists(dest_path):
+                    os.remove(dest_path)
+                print(f"Removed {dest_path}")
+                continue
+            start = time.perf_counter()
+            render_cache.set_block_cache(self.block_cache)
+            output = {"previous": self.manifest.last_output(path)}
+            try:
+                written = generate_page(path, self.template_path, dest_path, self.basepath, minify=self.minify,
+                                        output=output)
+            except Exception as e:
+                print(f"{path}: {type(e).__name__}: {e}")
+                continue
+            finally:
+                render_cache.set_block_cache(None)
+            self.manifest.record(path, dest_path, output=output["output"])
+            rebuilt.append(path)
+            status = "" if written else " (unchanged)"
+            print(f"Rebuilt {dest_path} in {(time.perf_counter() - start) * 1000:.1f} ms{status}")
+        self.manifest.save()
+        return rebuilt
+
+    def watch(self, interval, stop):
+        # Checks every interval seconds, twice as long after each check
+        # that found nothing, up to MAX_WATCH_INTERVAL
+        watcher = make_watcher(self.watched_paths())
+        wait = interval
+        try:
+            while not stop.wait(wait):
+                changed, removed = watcher.poll()
+                if not changed and not removed:
+                    wait = min(wait * 2, max(interval, MAX_WATCH_INTERVAL))
+                    continue
+                wait = interval
+                self.rebuild(changed, removed)
+                self.reloader.notify()
+                # A partial added to or dropped from the template
+                paths = self.watched_paths()
+                if paths != watcher.paths:
+                    watcher.close()
+                    watcher = make_watcher(paths)
+        finally:
+            watcher.close()
+
+    def serve(self, port, interval):
+        self.build_all()
+        server = ThreadingHTTPServer(("", port), make_handler(self.dest_dir_path, self.reloader, self.basepath))
+        server.daemon_threads = True
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        print(f"Serving {self.dest_dir_path} on http://localhost:{port}{self.basepath}")
+
+        stop = threading.Event()
+        try:
+            self.watch(interval, stop)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.shutdown()
+            self.manifest.save()
+
+
+def serve_main(argv, dir_path_content, dir_path_static, template_path, dest_dir_path):
+    parser = argparse.ArgumentParser(prog="main.py serve", description="Build, watch and serve the site with live reload")
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument("--basepath", default="/")
+    parser.add_argument("--interval", type=float, default=0.05,
+                        help="seconds between checks for changes, longer while nothing changes")
+    parser.add_argument("--minify", action="store_true", help="strip insignificant whitespace from the pages")
+    args = parser.parse_args(argv)
+    server = DevServer(dir_path_content, dir_path_static, template_path, dest_dir_path, args.basepath,
+                       minify=args.minify)
+    server.serve(args.port, args.interval)
@@ -0,0 +1,115 @@
+from itertools import chain
+
+from block import markdown_to_blocks, block_to_block_type, block_to_html, iter_blocks, BlockType
+from htmlnode import ParentNode
+
+FRONT_MATTER_FENCE = "---"
+# Front matter keys whose value is a comma separated list
+LIST_KEYS = {"tags"}
+
+
+def heading_level(block):
+    count = 0
+    for char in block:
+        if char != "#":
+            break
+        count += 1
+    return count
+
+
+class Document:
+    # A page parsed once: every consumer (title, headings, rendering...)
+    # reads from here instead of splitting the markdown again
+    def __init__(self, blocks, meta=None):
+        # list of (block text, BlockType)
+        self.blocks = blocks
+        # The page's front matter
+        self.meta = meta if meta is not None else {}
+        self._html_node = None
+
+    @property
+    def headings(self):
+        # list of (level, text), in document order
+        headings = []
+        for block, block_type in self.blocks:
+            if block_type == BlockType.HEADING:
+                headings.append((heading_level(block), block.lstrip("#").lstrip(" ")))
+        return headings
+
+    @property
+    def title(self):
+        return find_title((block, block_type, None) for block, block_type in self.blocks)
+
+    @property
+    def html_node(self):
+        if self._html_node is None:
+            child_nodes = [block_to_html(block, block_type) for block, block_type in self.blocks]
+            self._html_node = ParentNode(tag = "div", children = child_nodes)
+        return self._html_node
+
+    def write_html(self, write, cache=None, resolver=None):
+        # Same output as html_node.write_html, but blocks can come out of a
+        # BlockCache instead of being rendered again, and urls can go
+        # through a UrlResolver
+        if cache is None and resolver is None:
+            self.html_node.write_html(write)
+            return
+        write("<div>")
+        for block, block_type in self.blocks:
+            if cache is not None:
+                write(cache.render(block, block_type, resolver))
+            else:
+                block_to_html(block, block_type, resolver).write_html(write)
+        write("</div>")
+
+
+def find_title(typed_blocks):
+    # Stops at the first h1, so a streamed page is only read up to its title
+    for block, block_type, line_number in typed_blocks:
+        if block_type == BlockType.HEADING and heading_level(block) == 1:
+            return block.lstrip("# ").rstrip(" ")
+    raise Exception ("no header found")
+
+
+def parse_front_matter_value(key, value):
+    if key in LIST_KEYS:
+        return [item.strip() for item in value.strip("[]").split(",") if item.strip()]
+    return value
+
+
+def split_front_matter(lines):
+    # A page can start with "key: value" lines between two "---" lines.
+    # Returns (meta, lines): the lines come back with the front matter
+    # blanked out, so line numbers still point into the file
+    lines = iter(lines)
+    first = next(lines, None)
+    if first is None:
+        return {}, iter(())
+    if first.rstrip("\r\n") != FRONT_MATTER_FENCE:
+        return {}, chain([first], lines)
+    meta = {}
+    header = [first]
+    for line in lines:
+        header.append(line)
+        line = line.rstrip("\r\n")
+        if line == FRONT_MATTER_FENCE:
+            return meta, chain([""] * len(header), lines)
+        key, separator, value = line.partition(":")
+        if separator:
+            key = key.strip().lower()
+            meta[key] = parse_front_matter_value(key, value.strip())
+    # Never closed: it wasn't front matter after all
+    return {}, iter(header)
+
+
+def parse_document(markdown):
+    blocks = []
+    meta = {}
+    if markdown.startswith(FRONT_MATTER_FENCE):
+        meta, lines = split_front_matter(markdown.split("\n"))
+        split_blocks = [block for block, line_number in iter_blocks(lines)]
+    else:
+        split_blocks = markdown_to_blocks(markdown)
+    for block in split_blocks:
+        blocks.append((block, block_to_block_type(block)))
+    return Document(blocks, meta)
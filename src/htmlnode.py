@@ -1,4 +1,9 @@
 class HTMLNode():
+    # Pages turn into huge numbers of small nodes, slots keep each one compact.
+    # Only links and images have attributes; every other node shares None
+    # for its props instead of holding an empty dict of its own
+    __slots__ = ("tag", "value", "children", "props")
+
     def __init__(self, tag=None, value=None, children=None, props=None):
         self.tag = tag
         self.value = value
@@ -8,6 +13,11 @@ class HTMLNode():
     def to_html(self):
         raise NotImplementedError ("not implemented")
 
+    def write_html(self, write):
+        # Stream the html into write (list.append, StringIO.write, file.write...)
+        # instead of building it up as one string
+        write(self.to_html())
+
     def props_to_html(self):
         if not self.props: # This handles both None and {}
             return ""
@@ -22,6 +32,8 @@ class HTMLNode():
 
 
 class LeafNode(HTMLNode):
+    __slots__ = ()
+
     def __init__(self, tag, value, props = None):
         super().__init__(tag, value, None, props)
     
@@ -38,6 +50,8 @@ class LeafNode(HTMLNode):
     
 
 class ParentNode(HTMLNode):
+    __slots__ = ()
+
     def __init__(self, tag, children, props = None):
         super().__init__(tag, None, children, props)
 
@@ -47,11 +61,20 @@ class ParentNode(HTMLNode):
         if self.children is None:
             raise ValueError("children are needed")
 
-        childrenhtml = ""
-        for child in self.children:
-            childrenhtml += child.to_html()
+        parts = []
+        self.write_html(parts.append)
+        return "".join(parts)
 
-        return f"<{self.tag}{self.props_to_html()}>{childrenhtml}</{self.tag}>"
+    def write_html(self, write):
+        if self.tag is None:
+            raise ValueError("tags are needed")
+        if self.children is None:
+            raise ValueError("children are needed")
+
+        write(f"<{self.tag}{self.props_to_html()}>")
+        for child in self.children:
+            child.write_html(write)
+        write(f"</{self.tag}>")
 
     
 
@@ -1,5 +1,5 @@
 import re
-from textnode import TextNode, TextType, split_nodes_delimiter
+from textnode import TextNode, TextType
 
 def extract_markdown_images(text):
     pattern = r"!\[(.*?)\]\((.*?)\)"
@@ -59,14 +59,92 @@ def split_node_links(old_nodes):
             new_nodes.append(TextNode(text, TextType.TEXT))
     return new_nodes
 
+# Link text and urls never span a delimiter (those are split first) or a
+# bracket, which also keeps every failed match attempt short
+LINK_TEXT = r"[^\[\]`_\n*]*(?:\*(?!\*)[^\[\]`_\n*]*)*"
+LINK_URL = r"[^)\[\]`_\n*]*(?:\*(?!\*)[^)\[\]`_\n*]*)*"
+
+INLINE_TOKEN = re.compile(
+    r"(`|\*\*|_)"
+    rf"|!\[({LINK_TEXT})\]\(({LINK_URL})\)"
+    rf"|(?<!!)\[({LINK_TEXT})\]\(({LINK_URL})\)"
+)
+
+
+class DelimiterError(Exception):
+    # A ` ** or _ that is never closed, at position in the text
+    def __init__(self, message, position):
+        super().__init__(message)
+        self.position = position
+
+
 def text_to_textnodes(text):
-    node = [TextNode(text, TextType.TEXT)]
-    node = split_nodes_delimiter(node, "`", TextType.CODE)
-    node = split_nodes_delimiter(node, "**", TextType.BOLD)
-    node = split_nodes_delimiter(node, "_", TextType.ITALIC)
-    node = split_node_links(node)
-    node = split_node_images(node)
-    return node
+    return tokenize_inline(text, TextNode)
+
+
+def tokenize_inline(text, make_node):
+    # One left-to-right scan with the same precedence as splitting on
+    # code, then bold, then italic, then links and images.
+    # make_node(text, text_type, url) builds each node, so callers that want
+    # html can skip the intermediate TextNodes
+    nodes = []
+    length = len(text)
+    # Cached positions of the next code and bold delimiter, they only move forward
+    next_code = -1
+    next_bold = -1
+    pos = 0
+
+    while pos < length:
+        match = INLINE_TOKEN.search(text, pos)
+        if match is None:
+            break
+        start = match.start()
+        if start > pos:
+            nodes.append(make_node(text[pos:start], TextType.TEXT))
+
+        if match.lastindex == 3:
+            nodes.append(make_node(match.group(2), TextType.IMAGE, match.group(3)))
+            pos = match.end()
+            continue
+        if match.lastindex == 5:
+            nodes.append(make_node(match.group(4), TextType.LINK, match.group(5)))
+            pos = match.end()
+            continue
+
+        delimiter = match.group(1)
+        content_start = match.end()
+        close = text.find(delimiter, content_start)
+        if close == -1:
+            raise DelimiterError("missing closing delimiter", start)
+
+        if delimiter == "`":
+            text_type = TextType.CODE
+        else:
+            # Bold and italic can't run across a code span...
+            if next_code < content_start:
+                next_code = text.find("`", content_start)
+                if next_code == -1:
+                    next_code = length
+            if next_code < close:
+                raise DelimiterError("missing closing delimiter", start)
+            text_type = TextType.BOLD
+            if delimiter == "_":
+                # ...and italic can't run across bold either
+                if next_bold < content_start:
+                    next_bold = text.find("**", content_start)
+                    if next_bold == -1:
+                        next_bold = length
+                if next_bold < close:
+                    raise DelimiterError("missing closing delimiter", start)
+                text_type = TextType.ITALIC
+
+        if close > content_start:
+            nodes.append(make_node(text[content_start:close], text_type))
+        pos = close + len(delimiter)
+
+    if pos < length:
+        nodes.append(make_node(text[pos:], TextType.TEXT))
+    return nodes
 
 
 
@@ -1,29 +1,142 @@
 #print("hello world")
 from textnode import TextNode, TextType
-from copystatic import copy_files_recursive
+from copystatic import sync_files_recursive
 import os
 import shutil
-from page_generator import generate_page, generate_pages_recursive
+from page_generator import generate_page, generate_pages_recursive, BuildError
+from build import build_site
+import argparse
 import sys
+import time
+from profiler import Profiler
+from render_cache import BlockCache, BLOCK_CACHE_PATH
+from devserver import serve_main
+from daemon import daemon_main
+from check import check_main
+from precompress import precompress_tree
+from assets import AssetManifest, ASSET_MANIFEST_NAME
+from search import SearchIndex
+from shard import parse_shard, build_shard, merge_main
 
 def main():
-    basepath = "/"
-    if len(sys.argv) > 1:
-        basepath = sys.argv[1]
+    dir_path_static = "./static"
+    dir_path_docs = "./docs" 
+    dir_path_content = "./content"
+    template_path = "./template.html"
+
+    # python3 src/main.py serve [...] runs the dev server instead of a build
+    argv = sys.argv[1:]
+    if argv[:1] == ["serve"]:
+        serve_main(argv[1:], dir_path_content, dir_path_static, template_path, dir_path_docs)
+        return
+    # python3 src/main.py daemon [...] keeps the build warm behind a local render API
+    if argv[:1] == ["daemon"]:
+        daemon_main(argv[1:], dir_path_content, dir_path_static, template_path, dir_path_docs)
+        return
+    # python3 src/main.py check [basepath] reports every broken page without writing anything
+    if argv[:1] == ["check"]:
+        check_main(argv[1:], dir_path_content, template_path, dir_path_docs)
+        return
+    # python3 src/main.py merge [shard dirs] puts the output of --shard builds together
+    if argv[:1] == ["merge"]:
+        merge_main(argv[1:], dir_path_static, dir_path_docs)
+        return
+
+    parser = argparse.ArgumentParser(description="Build the site from ./content into ./docs")
+    parser.add_argument("basepath", nargs="?", default="/")
+    parser.add_argument("--force", action="store_true", help="rebuild every page, even unchanged ones")
+    parser.add_argument("--clean", action="store_true", help="wipe docs/ and copy every static file again")
+    parser.add_argument("--checksum", action="store_true", help="compare static files by content when size matches but mtime differs")
+    parser.add_argument("--link", choices=["auto", "reflink", "hardlink", "copy"], default="auto", help="how changed static files are placed in docs/")
+    parser.add_argument("--jobs", "-j", type=int, default=0, help="number of worker processes (default: one per core, 1 = serial)")
+    parser.add_argument("--io-threads", type=int, default=4,
+                        help="threads reading and writing pages around a serial render (0 = read and write inline)")
+    parser.add_argument("--block-cache-size", type=int, default=4096, help="rendered blocks kept in memory (0 disables the cache)")
+    parser.add_argument("--block-cache-file", nargs="?", const=BLOCK_CACHE_PATH, metavar="PATH",
+                        help="keep rendered blocks on disk between builds")
+    parser.add_argument("--fingerprint", action="store_true",
+                        help="copy static files as name.<hash>.ext and point pages and the template at them")
+    parser.add_argument("--search", action="store_true",
+                        help="write a client-side search index (and search.js) into docs/search/")
+    parser.add_argument("--minify", action="store_true",
+                        help="strip insignificant whitespace from the pages (<pre> and <code> are left alone)")
+    parser.add_argument("--gzip", nargs="?", type=int, const=9, choices=range(1, 10), metavar="LEVEL",
+                        help="write a .gz next to every changed text file in docs/ (compression level 1-9, default 9)")
+    parser.add_argument("--shard", type=parse_shard, metavar="I/N",
+                        help="only render the I-th of N shares of the pages, into shards/I-of-N/ (see main.py merge)")
+    parser.add_argument("--verbose", "-v", action="store_true", help="print every file instead of a progress summary")
+    parser.add_argument("--profile", nargs="?", const="profile.json", metavar="REPORT",
+                        help="time every page and stage, write the report (.json or .csv) here")
+    parser.add_argument("--profile-top", type=int, default=10, help="how many of the slowest pages to list")
+    args = parser.parse_args(argv)
+    basepath = args.basepath
+    if args.shard is not None and (args.search or args.clean or args.gzip is not None):
+        parser.error("--shard can't be combined with --search, --clean or --gzip (merge takes --gzip)")
     # Create a TextNode with dummy data
     #node = TextNode("some text here", TextType.LINK, "https://example.com")
     
     # Print it
     #print(node)
 
-    dir_path_static = "./static"
-    dir_path_docs = "./docs" 
-    dir_path_content = "./content"
-    template_path = "./template.html"
+    profiler = Profiler() if args.profile else None
+    block_cache = None
+    if args.block_cache_size > 0:
+        block_cache = BlockCache(args.block_cache_size, args.block_cache_file)
+        block_cache.load()
+
+    if args.shard is not None:
+        # Static files are left to the merge, which copies them once
+        assets = AssetManifest.build(dir_path_static) if args.fingerprint else None
+        try:
+            build_shard(dir_path_content, template_path, basepath, args.shard, assets, minify=args.minify,
+                        force=args.force, jobs=args.jobs, verbose=args.verbose, block_cache=block_cache,
+                        io_threads=args.io_threads)
+        except BuildError as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        return
+
+    start = time.perf_counter()
+    asset_manifest_path = os.path.join(dir_path_docs, ASSET_MANIFEST_NAME)
+    assets = None
+    if args.fingerprint:
+        # Only static files whose size or mtime changed are hashed again
+        assets = AssetManifest.build(dir_path_static, AssetManifest.load(asset_manifest_path))
+    elif os.path.exists(asset_manifest_path):
+        os.remove(asset_manifest_path)
 
-    copy_files_recursive(dir_path_static, dir_path_docs)
+    if args.clean:
+        # The sync copies everything again into the empty docs/, and records it
+        shutil.rmtree(dir_path_docs, ignore_errors=True)
+    stats = sync_files_recursive(dir_path_static, dir_path_docs, checksum=args.checksum, link=args.link,
+                                 verbose=args.verbose, names=assets.names() if assets is not None else None)
+    print(f"Static files: {stats['copied']} copied, {stats['unchanged']} unchanged, {stats['removed']} removed")
+    if profiler is not None:
+        profiler.add_stage("static_copy", time.perf_counter() - start, stats["bytes"], stats["copied"])
+    if assets is not None:
+        assets.save(asset_manifest_path)
     #generate_page("content/index.md", "template.html", "public/index.html")
-    generate_pages_recursive(dir_path_content, template_path, dir_path_docs, basepath)
+    try:
+        build_site(dir_path_content, template_path, dir_path_docs, basepath, force=args.force, jobs=args.jobs,
+                   profiler=profiler, verbose=args.verbose, block_cache=block_cache, assets=assets,
+                   io_threads=args.io_threads, search=SearchIndex.load() if args.search else None,
+                   minify=args.minify)
+        if args.gzip is not None:
+            start = time.perf_counter()
+            stats = precompress_tree(dir_path_docs, args.gzip, args.jobs, args.verbose)
+            print(f"Compressed {stats['compressed']} files ({stats['bytes']} -> {stats['gz_bytes']} bytes), "
+                  f"{stats['removed']} stale .gz removed")
+            if profiler is not None:
+                profiler.add_stage("compress", time.perf_counter() - start, stats["bytes"], stats["compressed"])
+    except BuildError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if profiler is not None:
+            profiler.write(args.profile, args.profile_top)
+            print(profiler.summary(args.profile_top))
+            print(f"Profile written to {args.profile}")
 
-# Actually call the function
-main()
+# Actually call the function (guarded so worker processes don't rerun the build)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+
+# Bump this whenever a change to the renderer changes the generated html,
+# so every page gets rebuilt on the next run.
+RENDERER_VERSION = "5"
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_build_key(*parts):
+    # Anything that changes the output of every page (template, basepath,
+    # renderer version...) goes into the build key
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class BuildManifest:
+    def __init__(self, path, build_key=None, pages=None):
+        self.path = path
+        self.build_key = build_key
+        # from_path -> {"dest", "size", "mtime", "hash"}, "output" (the
+        # OutputFile.output of dest) if known, and "listing" and "assets"
+        # ({site path: hash} of the static files it links to) if any
+        self.pages = pages if pages is not None else {}
+        self.seen = set()
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return cls(path)
+        return cls(path, data.get("build_key"), data.get("pages", {}))
+
+    def set_build_key(self, build_key):
+        # A different template/basepath/renderer means every page is stale,
+        # but we keep the old entries around so deleted pages can be pruned
+        if build_key != self.build_key:
+            self.dirty = True
+        self.build_key = build_key
+
+    def is_fresh(self, from_path, dest_path, listing=None, assets=None):
+        # listing is a digest of what the page shows of other pages (see
+        # SiteIndex.page_values), for pages that have to follow their edits.
+        # assets is the AssetManifest, when the page's urls are fingerprinted
+        self.seen.add(from_path)
+        entry = self.pages.get(from_path)
+        if self.dirty or entry is None or entry["dest"] != dest_path:
+            return False
+        if entry.get("listing") != listing:
+            return False
+        if assets is not None and not assets.is_current(entry.get("assets", {}).items()):
+            return False
+        if not os.path.exists(dest_path):
+            return False
+
+        stat = os.stat(from_path)
+        if stat.st_size != entry["size"]:
+            return False
+        if stat.st_mtime_ns == entry["mtime"]:
+            return True
+
+        # The file was touched, only rebuild if the content really changed
+        if hash_file(from_path) != entry["hash"]:
+            return False
+        entry["mtime"] = stat.st_mtime_ns
+        return True
+
+    def last_output(self, from_path):
+        # What the last build wrote for from_path, for OutputFile's previous
+        entry = self.pages.get(from_path)
+        return entry.get("output") if entry is not None else None
+
+    def record(self, from_path, dest_path, listing=None, asset_hashes=None, output=None):
+        self.seen.add(from_path)
+        stat = os.stat(from_path)
+        self.pages[from_path] = {
+            "dest": dest_path,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "hash": hash_file(from_path),
+        }
+        if output is not None:
+            self.pages[from_path]["output"] = output
+        if listing is not None:
+            self.pages[from_path]["listing"] = listing
+        if asset_hashes:
+            self.pages[from_path]["assets"] = dict(asset_hashes)
+
+    def forget(self, from_path):
+        self.pages.pop(from_path, None)
+
+    def prune(self):
+        # Remove the output of every page whose source is gone
+        removed = []
+        for from_path in list(self.pages):
+            if from_path in self.seen:
+                continue
+            dest_path = self.pages.pop(from_path)["dest"]
+            if os.path.exists(dest_path):
+                os.remove(dest_path)
+                removed.append(dest_path)
+                try:
+                    os.rmdir(os.path.dirname(dest_path))
+                except OSError:
+                    pass
+        return removed
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"build_key": self.build_key, "pages": self.pages}, f)
+        os.replace(tmp_path, self.path)
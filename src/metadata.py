@@ -0,0 +1,208 @@
+import hashlib
+import json
+import os
+
+from block import iter_typed_blocks
+from document import find_title, split_front_matter
+from urls import site_path
+
+SITE_INDEX_PATH = "./.cache/site-index.json"
+
+# Template slots answered from the site index rather than from the page:
+#   {{ Prev }} {{ Next }}     the neighbouring pages of the same section, by date
+#   {{ Pages [/section/] [N] }} a section's pages, newest first (default: the page's own)
+#   {{ Recent [N] }}          the N newest pages with a date, site-wide
+#   {{ Tagged tag [N] }}      the pages with that tag, newest first
+INDEX_SLOTS = {"Prev", "Next", "Pages", "Recent", "Tagged"}
+RECENT_COUNT = 5
+
+
+def uses_site_index(template):
+    return any(slot.name in INDEX_SLOTS for slot in template.slots())
+
+
+def page_path(dest_path, dest_dir_path):
+    # docs/blog/tom/index.html -> /blog/tom/, without the basepath
+    path = site_path(dest_path, dest_dir_path)
+    if path.endswith("/index.html"):
+        path = path[:-len("index.html")]
+    return path
+
+
+def section_of(path):
+    # /blog/tom/ -> /blog/, /blog/tom.html -> /blog/, / -> None
+    if path == "/":
+        return None
+    return path[:path.rstrip("/").rfind("/") + 1]
+
+
+def read_page_metadata(from_path):
+    # Only reads the page up to its title
+    with open(from_path, "r", encoding="utf-8") as f:
+        meta, lines = split_front_matter(f)
+        try:
+            title = find_title(iter_typed_blocks(lines))
+        except Exception:
+            # The page's own build will report it
+            title = None
+    return meta, title
+
+
+def newest_first(entries):
+    entries = sorted(entries, key=lambda entry: entry["path"])
+    return sorted(entries, key=lambda entry: entry["date"], reverse=True)
+
+
+class SiteIndex:
+    # The title, date, tags and front matter of every page, refreshed in
+    # one pass before any page renders, so listing and navigation pages
+    # don't have to read their siblings. Kept in .cache/ so only pages whose
+    # source changed are read again.
+    def __init__(self, path=SITE_INDEX_PATH, pages=None):
+        self.path = path
+        # from_path -> {"path", "title", "date", "tags", "meta", "size", "mtime"}
+        self.pages = pages if pages is not None else {}
+        self.changed = False
+        self.reset()
+
+    def reset(self):
+        # Derived from pages, rebuilt on first use after a refresh
+        self.sections = None
+        self.neighbour_pages = None
+        self.rendered = {}
+
+    @classmethod
+    def load(cls, path=SITE_INDEX_PATH):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return cls(path)
+        return cls(path, data["pages"])
+
+    def save(self):
+        if not self.changed:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"pages": self.pages}, f)
+        os.replace(tmp_path, self.path)
+        self.changed = False
+
+    def refresh(self, pages, dest_dir_path):
+        # pages: (from_path, dest_path) of the whole site. Returns them as a
+        # list. Pages whose size and mtime are unchanged aren't opened.
+        pages = list(pages)
+        seen = set()
+        for from_path, dest_path in pages:
+            seen.add(from_path)
+            stat = os.stat(from_path)
+            entry = self.pages.get(from_path)
+            path = page_path(dest_path, dest_dir_path)
+            if (entry is not None and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns
+                    and entry["path"] == path):
+                continue
+            meta, title = read_page_metadata(from_path)
+            self.pages[from_path] = {
+                "path": path,
+                "title": title,
+                "date": meta.get("date", ""),
+                "tags": meta.get("tags", []),
+                "meta": meta,
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns,
+            }
+            self.changed = True
+        for from_path in list(self.pages):
+            if from_path not in seen:
+                del self.pages[from_path]
+                self.changed = True
+        self.reset()
+        return pages
+
+    def build_sections(self):
+        # section path -> its pages oldest first, and every page's neighbours
+        self.sections = {}
+        for entry in self.pages.values():
+            self.sections.setdefault(section_of(entry["path"]), []).append(entry)
+        self.neighbour_pages = {}
+        for section, entries in self.sections.items():
+            entries = self.sections[section] = newest_first(entries)[::-1]
+            for index, entry in enumerate(entries):
+                self.neighbour_pages[entry["path"]] = (entries[index - 1] if index > 0 else None,
+                                                       entries[index + 1] if index + 1 < len(entries) else None)
+
+    def section(self, section):
+        if self.sections is None:
+            self.build_sections()
+        return self.sections.get(section, [])
+
+    def neighbours(self, from_path):
+        # (older, newer) page of the same section, or None
+        if self.sections is None:
+            self.build_sections()
+        return self.neighbour_pages[self.pages[from_path]["path"]]
+
+    def query(self, key, name, args, page, basepath):
+        # The html of one listing, rendered once per build however many pages show it
+        count = int(args[-1]) if args and args[-1].isdigit() else None
+        if count is not None:
+            args = args[:-1]
+        section = None
+        if name == "Pages":
+            # Without a section, the page's own: a different listing per section
+            section = args[0] if args else page["path"]
+        cache_key = (key, section, basepath)
+        html = self.rendered.get(cache_key)
+        if html is not None:
+            return html
+        if name == "Pages":
+            entries = newest_first(self.section(section))
+        elif name == "Recent":
+            entries = newest_first(entry for entry in self.pages.values() if entry["date"])
+            count = count if count is not None else RECENT_COUNT
+        else:
+            tag = args[0] if args else ""
+            entries = newest_first(entry for entry in self.pages.values() if tag in entry["tags"])
+        html = page_list(entries[:count], basepath)
+        self.rendered[cache_key] = html
+        return html
+
+    def page_values(self, template, from_path, basepath):
+        # slot key -> html, for the template's slots that query the index
+        page = self.pages[from_path]
+        values = {}
+        for slot in template.slots():
+            if slot.name in ("Prev", "Next"):
+                previous, following = self.neighbours(from_path)
+                values[slot.key] = page_link(previous if slot.name == "Prev" else following, slot.name.lower(),
+                                             basepath)
+            elif slot.name in INDEX_SLOTS:
+                values[slot.key] = self.query(slot.key, slot.name, slot.args, page, basepath)
+        return values
+
+
+def entry_title(entry):
+    return entry["title"] if entry["title"] is not None else entry["path"]
+
+
+def page_link(entry, rel, basepath):
+    if entry is None:
+        return ""
+    return f'<a rel="{rel}" href="{basepath}{entry["path"][1:]}">{entry_title(entry)}</a>'
+
+
+def page_list(entries, basepath):
+    items = []
+    for entry in entries:
+        date = f' <time datetime="{entry["date"]}">{entry["date"]}</time>' if entry["date"] else ""
+        items.append(f'<li><a href="{basepath}{entry["path"][1:]}">{entry_title(entry)}</a>{date}</li>')
+    return f'<ul class="pages">{"".join(items)}</ul>'
+
+
+def values_digest(values):
+    # What a page showed from the index: when it changes, the page is rebuilt
+    return hashlib.sha256(json.dumps(values, sort_keys=True).encode("utf-8")).hexdigest()
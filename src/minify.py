@@ -0,0 +1,118 @@
+import re
+
+# Elements whose whitespace is part of the content
+PRESERVED_TAG = re.compile(r"<(/?)(pre|code|textarea|script|style)\b[^>]*>", re.IGNORECASE)
+
+# Only ASCII whitespace: a no-break space is content
+WHITESPACE = " \t\n\r\f"
+# A run is a newline, tab etc. or more than one space. Single spaces between
+# words are never touched, so text without runs costs a few str.find calls
+RUN = re.compile(r"[ \t\n\r\f]{2,}|[\t\n\r\f]")
+
+# Runs next to these tags never render, so they are dropped instead of
+# collapsed to a space (around inline tags like <a> or <b> they would show).
+# collapse turns every run into a single "\n" first, to find them.
+BLOCK_TAGS = (r"html|head|body|meta|link|title|base|article|section|nav|header|footer|main|aside|div|p|h[1-6]|ul|ol"
+              r"|li|blockquote|pre|table|thead|tbody|tfoot|tr|td|th|hr|figure|figcaption|form|!doctype")
+RUN_BEFORE_BLOCK = re.compile(rf"\n(</?(?:{BLOCK_TAGS})\b)", re.IGNORECASE)
+RUN_AFTER_BLOCK = re.compile(rf"(</?(?:{BLOCK_TAGS})\b[^>]*>)\n", re.IGNORECASE)
+BLOCK_TAG = re.compile(rf"</?(?:{BLOCK_TAGS})\b[^>]*>", re.IGNORECASE)
+
+
+def collapse(html):
+    if "\n" not in html and "  " not in html and "\t" not in html and "\r" not in html and "\f" not in html:
+        return html
+    html = RUN.sub("\n", html)
+    html = RUN_AFTER_BLOCK.sub(r"\1", RUN_BEFORE_BLOCK.sub(r"\1", html))
+    return html.replace("\n", " ")
+
+
+class HtmlMinifier:
+    # Collapses the whitespace runs of a page as it streams through, in
+    # whatever pieces it comes: each run becomes one space, or nothing next
+    # to a block tag. <pre>, <code>, <textarea>, <script> and <style> pass
+    # through untouched. It's one pass, and nothing is parsed again after.
+    # minify() returns what the next piece can't change any more, holding
+    # back the last tag and what follows it; finish() returns the rest.
+    def __init__(self):
+        # Open preserved elements we're inside of
+        self.depth = 0
+        self.carry = ""
+        self.started = False
+        # Whether what feed() returned last ends with a block tag, so a run
+        # at the start of the next piece goes too
+        self.after_block = False
+
+    def minify(self, text):
+        text = self.carry + text
+        cut = text.rfind("<")
+        if cut == -1:
+            cut = len(text)
+        # A run before the tag belongs with it
+        cut = len(text[:cut].rstrip(WHITESPACE))
+        self.carry = text[cut:]
+        return self.feed(text[:cut])
+
+    def finish(self, final=True):
+        # With final=False more html follows that doesn't go through here
+        # (a template slot), so a run at the end becomes a space
+        text = self.carry
+        self.carry = ""
+        html = self.feed(text)
+        return html.rstrip(WHITESPACE) if final and not self.depth else html
+
+    def feed(self, text):
+        if self.after_block and not self.depth:
+            run = RUN.match(text)
+            if run is not None:
+                text = text[run.end():]
+        out = []
+        # Start of the text not handled yet
+        position = 0
+        for match in PRESERVED_TAG.finditer(text):
+            closing = match.group(1)
+            if not self.depth:
+                if not closing:
+                    # The opening tag goes through collapse, for the run before it
+                    out.append(collapse(text[position:match.end()]))
+                    position = match.end()
+                    self.depth = 1
+            else:
+                self.depth += -1 if closing else 1
+                if not self.depth:
+                    # And the closing one too, for the run after it
+                    out.append(text[position:match.start()])
+                    position = match.start()
+        out.append(text[position:] if self.depth else collapse(text[position:]))
+        html = "".join(out)
+        if not self.started:
+            html = html.lstrip(WHITESPACE)
+            self.started = html != ""
+        if html:
+            self.after_block = (not self.depth and html.endswith(">")
+                                and BLOCK_TAG.fullmatch(html, html.rfind("<")) is not None)
+        return html
+
+
+def minify_html(html):
+    minifier = HtmlMinifier()
+    return minifier.minify(html) + minifier.finish()
+
+
+def minify_segments(segments):
+    # The static strings of a compiled template, minified once when it's
+    # compiled. What fills the slots in between is unknown, so a run next
+    # to a slot becomes a space rather than nothing.
+    minifier = HtmlMinifier()
+    minified = []
+    for segment in segments:
+        if isinstance(segment, str):
+            minified.append(minifier.minify(segment))
+        else:
+            minified.append(minifier.finish(final=False))
+            # What fills the slot is unknown, so nothing carries over it
+            minifier.started = True
+            minifier.after_block = False
+            minified.append(segment)
+    minified.append(minifier.finish())
+    return minified
@@ -0,0 +1,144 @@
+import hashlib
+import os
+
+from minify import HtmlMinifier
+
+# Directories we know exist, so every page doesn't mkdir its parents again.
+# Cleared at the start of each build with reset_dirs.
+created_dirs = set()
+
+
+def reset_dirs():
+    created_dirs.clear()
+
+
+def make_dirs(path):
+    if path in created_dirs:
+        return
+    os.makedirs(path, exist_ok=True)
+    created_dirs.add(path)
+
+
+def digest_file(path):
+    digest = hashlib.blake2b()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+
+class OutputFile:
+    # Streams text towards `path`, hashing it on the way. On close it
+    # replaces `path` (through a temp file next to it), unless `path`
+    # already holds the same bytes: then `path` keeps its mtime, so rsync
+    # and the CDN only see pages that really changed.
+    # Up to hold_size bytes are held in memory, so an unchanged page never
+    # touches the disk; a bigger one goes to the temp file as it comes.
+    # previous is the `output` of the last OutputFile for `path`, [digest,
+    # size, mtime]: while `path` still has that size and mtime, the digest is
+    # compared instead of reading `path` back.
+    # With binary=True, write() takes bytes instead of text, and with
+    # minify=True the html is minified a buffer at a time on its way out.
+    def __init__(self, path, buffer_size=1 << 16, binary=False, minify=False, previous=None, hold_size=1 << 20):
+        self.path = path
+        self.binary = binary
+        self.minifier = HtmlMinifier() if minify else None
+        self.buffer_size = buffer_size
+        self.previous = previous
+        self.hold_size = hold_size
+        directory, filename = os.path.split(path)
+        self.tmp_path = os.path.join(directory, f".{filename}.{os.getpid()}.tmp")
+        self.parts = []
+        self.pending = 0
+        self.size = 0
+        self.digest = hashlib.blake2b()
+        # What was flushed while the temp file isn't open
+        self.held = []
+        self.file = None
+        # Set on close: True if path was replaced, False if it was identical,
+        # and [digest, size, mtime] of what path holds now
+        self.written = None
+        self.output = None
+
+    def open(self):
+        directory = os.path.dirname(self.path)
+        try:
+            self.file = open(self.tmp_path, "wb")
+        except FileNotFoundError:
+            # Someone removed the directory since we made it
+            created_dirs.discard(directory)
+            make_dirs(directory)
+            self.file = open(self.tmp_path, "wb")
+        for data in self.held:
+            self.file.write(data)
+        self.held = []
+
+    def write(self, text):
+        self.parts.append(text)
+        self.pending += len(text)
+        if self.pending >= self.buffer_size:
+            self.flush()
+
+    def flush(self, final=False):
+        if self.binary:
+            data = b"".join(self.parts)
+        elif self.minifier is not None:
+            text = self.minifier.minify("".join(self.parts))
+            if final:
+                text += self.minifier.finish()
+            data = text.encode("utf-8")
+        else:
+            data = "".join(self.parts).encode("utf-8")
+        self.parts = []
+        self.pending = 0
+        self.size += len(data)
+        self.digest.update(data)
+        if self.file is not None:
+            self.file.write(data)
+            return
+        self.held.append(data)
+        if self.size > self.hold_size:
+            self.open()
+
+    def is_unchanged(self, stat):
+        if stat is None or stat.st_size != self.size:
+            return False
+        if self.previous is not None and self.previous[1:] == [stat.st_size, stat.st_mtime_ns]:
+            return self.previous[0] == self.digest.hexdigest()
+        try:
+            return digest_file(self.path) == self.digest.digest()
+        except OSError:
+            return False
+
+    def close(self):
+        self.flush(final=True)
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            stat = None
+        self.written = not self.is_unchanged(stat)
+        if self.written:
+            if self.file is None:
+                self.open()
+            self.file.close()
+            os.replace(self.tmp_path, self.path)
+            stat = os.stat(self.path)
+        elif self.file is not None:
+            self.file.close()
+            os.remove(self.tmp_path)
+        self.output = [self.digest.hexdigest(), stat.st_size, stat.st_mtime_ns]
+        return self.written
+
+    def discard(self):
+        if self.file is not None:
+            self.file.close()
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
@@ -1,62 +1,384 @@
 from pathlib import Path
-from block import markdown_to_html_node, markdown_to_blocks, block_to_block_type, block_to_html, BlockType
-from htmlnode import ParentNode, LeafNode, HTMLNode
+from collections import Counter
+from document import parse_document, find_title, split_front_matter
+from block import iter_typed_blocks, iter_file_lines, write_markdown_html
+from template import load_template
+from urls import UrlResolver
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import deque
+from profiler import PageTimer, Progress
+from output import OutputFile, make_dirs, reset_dirs
+import render_cache
+import urls
+from search import page_terms, add_terms
+from metadata import values_digest
+from walk import walk_tree
 import os
+import hashlib
+
+
+# Pages bigger than this are streamed block by block from a memory map
+# instead of being parsed into a Document all at once
+LARGE_PAGE_BYTES = 8 * 1024 * 1024
+
+# How many pages a serial build reads ahead of, and writes behind, the render
+PIPELINE_DEPTH = 16
+
+PAGE_EXTENSION = ".md"
+
+
+class BuildError(Exception):
+    def __init__(self, errors):
+        # errors is a list of (from_path, message) pairs, one per failed page
+        self.errors = errors
+        lines = [f"{len(errors)} page(s) failed to build:"]
+        for from_path, message in errors:
+            lines.append(f"  {from_path}: {message}")
+        super().__init__("\n".join(lines))
 
 
 def extract_title(markdown):
-    blocks = markdown_to_blocks(markdown)
-    for block in blocks:
-        if block_to_block_type(block) == BlockType.HEADING:
-            node = block_to_html(block, BlockType.HEADING)
-            if node.tag == "h1":
-                title = block.lstrip("# ").rstrip(" ")
-                return title
-        continue
-
-    raise Exception ("no header found")
-
-def generate_page(from_path, template_path, dest_path, basepath):
-    print(f"Generating page {from_path} to {dest_path} using {template_path}")
+    return parse_document(markdown).title
+
+def generate_page(from_path, template_path, dest_path, basepath, timer=None, resolver=None, contents=None, write=None,
+                  index=None, minify=False, site_values=None, output=None):
+    # Returns False when dest_path already held exactly this page and was left alone.
+    # A PageTimer gets the time spent in each stage and the bytes written.
+    # Link and image urls go through resolver, which collects broken links.
+    # contents is the source when the caller already read it, and with write
+    # the html goes there instead of to dest_path (and None is returned).
+    # index, if given, is a dict that gets the page's title and search terms.
+    # With minify the page is stripped of insignificant whitespace; a caller
+    # passing write gets it with only the template minified, and runs it
+    # through an HtmlMinifier itself (write_output does).
+    # site_values fills the template's site index slots ({{ Prev }}...)
+    # output, if given, is a dict whose "previous" is the OutputFile.output
+    # dest_path was last written with, if known; it gets this one's in "output"
+    if resolver is None:
+        resolver = UrlResolver(basepath)
     path = Path(from_path)
     template_path = Path(template_path)
     destination = Path(dest_path)
 
-    contents = path.read_text(encoding="utf-8")
-    template = template_path.read_text(encoding="utf-8")
+    # Compiled once per process, with the basepath already applied
+    template = load_template(template_path, basepath, resolver.assets, minify)
+    if timer is not None:
+        timer.lap("template")
+    cache = render_cache.block_cache
+
+    # Search terms counted while a large page renders
+    terms = None
+    if contents is None and path.stat().st_size >= LARGE_PAGE_BYTES:
+        # Read up to the title, then render the blocks as they are parsed.
+        # The title goes out before the content, so the blocks up to the
+        # first h1 are parsed twice; the rest of the page only once.
+        meta, lines = split_front_matter(iter_file_lines(path))
+        title = find_title(iter_typed_blocks(lines))
+        blocks = iter_page_blocks(path)
+        if index is not None:
+            terms = Counter()
+            blocks = counting_terms(blocks, terms)
+        content = lambda write: write_markdown_html(blocks, write, cache, resolver)
+    else:
+        # Split and classify the blocks once, for the title and the content
+        if contents is None:
+            contents = path.read_text(encoding="utf-8")
+        if timer is not None:
+            timer.lap("read")
+        document = parse_document(contents)
+        title = document.title
+        meta = document.meta
+        content = lambda write: document.write_html(write, cache, resolver)
+        if index is not None:
+            index["terms"] = page_terms((block, block_type, None) for block, block_type in document.blocks)
+    if index is not None:
+        index["title"] = title
+    if timer is not None:
+        timer.lap("parse")
+
+    # Stream the page straight into the file, the content included
+    values = template_values(title, content, meta, site_values)
+
+    if write is not None:
+        template.write(write if timer is None else timer.writer(write), values)
+        if terms is not None:
+            index["terms"] = dict(terms)
+        if timer is not None:
+            timer.finish_stream()
+        return None
+
+    make_dirs(str(destination.parent))
+    previous = output.get("previous") if output is not None else None
+    with OutputFile(str(destination), minify=minify, previous=previous) as out:
+        template.write(out.write if timer is None else timer.writer(out.write), values)
+    if output is not None:
+        output["output"] = out.output
+    if terms is not None:
+        index["terms"] = dict(terms)
+    if timer is not None:
+        timer.finish_stream()
+        timer.bytes = out.size
+    return out.written
+
+
+def template_values(title, content, meta, site_values=None):
+    # What the template's slots are filled with, in a build and a preview alike
+    values = {
+        "Title": title,
+        "Content": content,
+        "Date": meta.get("date", ""),
+        "Tags": ", ".join(meta.get("tags", [])),
+    }
+    if site_values is not None:
+        values.update(site_values)
+    return values
+
+
+def page_dest_path(from_path, dir_path_content, dest_dir_path):
+    # Where iter_pages would put a single page, for callers that only have its path
+    return os.path.join(dest_dir_path, html_relpath(os.path.relpath(from_path, dir_path_content)))
+
+
+def html_relpath(relpath):
+    # blog/tom/index.md -> blog/tom/index.html
+    return relpath[:-len(PAGE_EXTENSION)] + ".html"
+
+
+def page_url(dest_path, dest_dir_path, basepath):
+    # docs/blog/tom/index.html -> /blog/tom/ (with the basepath)
+    path = urls.site_path(dest_path, dest_dir_path)
+    if path.endswith("/index.html"):
+        path = path[:-len("index.html")]
+    return basepath + path[1:]
+
+
+def page_key(from_path, dir_path_content):
+    # The same on every machine, wherever the checkout is
+    return os.path.relpath(from_path, dir_path_content).replace(os.sep, "/")
+
+
+def shard_of(key, count):
+    # 1-based, stable across machines and Python runs (unlike hash())
+    return int.from_bytes(hashlib.sha256(key.encode("utf-8")).digest()[:8], "big") % count + 1
+
+
+def in_shard(from_path, dir_path_content, shard):
+    index, count = shard
+    return shard_of(page_key(from_path, dir_path_content), count) == index
+
+
+def iter_pages(dir_path_content, dest_dir_path):
+    # (source, destination) of every markdown file in the content folder,
+    # in walk order. A build still keeps every page (as a link target, and
+    # in the site index when the template uses one), so this saves the walk
+    # its own list, not the memory of a page per page
+    for entry, relpath in walk_tree(dir_path_content, PAGE_EXTENSION):
+        yield entry.path, os.path.join(dest_dir_path, html_relpath(relpath))
+
+
+def find_pages(dir_path_content, dest_dir_path):
+    return list(iter_pages(dir_path_content, dest_dir_path))
+
+
+def init_worker(block_cache, site_resolver):
+    render_cache.set_block_cache(block_cache)
+    urls.set_site_resolver(site_resolver)
+
+
+def render_page(task, read=None, parts=None):
+    # Runs in a worker process, so the error has to come back as a value,
+    # along with whatever the worker added to its block cache.
+    # In a pipelined build, read is the future of the prefetched source and
+    # the html is collected in parts for a writer thread (written is None then)
+    from_path, template_path, dest_path, basepath, profile, indexed, minify, site_values, previous = task
+    timer = PageTimer() if profile else None
+    index = {} if indexed else None
+    output = {"previous": previous}
+    resolver = None
+    if urls.site_resolver is not None:
+        resolver = urls.site_resolver.for_page(dest_path)
+    written = False
+    timings = None
+    try:
+        contents = read.result() if read is not None else None
+        write = parts.append if parts is not None and contents is not None else None
+        written = generate_page(from_path, template_path, dest_path, basepath, timer, resolver, contents, write, index,
+                                minify, site_values, output)
+        error = None
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    if timer is not None and error is None:
+        timings = timer.result()
+    cache_changes = None
+    if render_cache.block_cache is not None:
+        cache_changes = render_cache.block_cache.take_changes()
+    broken = resolver.broken if resolver is not None else []
+    asset_hashes = resolver.asset_hashes if resolver is not None else []
+    return from_path, dest_path, error, written, output.get("output"), timings, cache_changes, broken, asset_hashes, index
+
+
+def pool_size(jobs, task_count):
+    # jobs=None (or 0) means one worker per core
+    if not jobs:
+        jobs = os.cpu_count() or 1
+    return max(1, min(jobs, task_count))
+
+
+def read_source(from_path):
+    # Large pages are left to generate_page, which streams them from a memory map
+    if os.path.getsize(from_path) >= LARGE_PAGE_BYTES:
+        return None
+    with open(from_path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def iter_page_blocks(path):
+    # A large page's typed blocks straight from its memory map, without the front matter
+    meta, lines = split_front_matter(iter_file_lines(path))
+    return iter_typed_blocks(lines)
+
+
+def counting_terms(typed_blocks, terms):
+    # Passes the blocks on to the render, adding up their search terms on the way
+    for block, block_type, line_number in typed_blocks:
+        add_terms(terms, block, block_type)
+        yield block, block_type, line_number
+
+
+def write_output(dest_path, parts, minify=False, previous=None):
+    make_dirs(os.path.dirname(dest_path))
+    with OutputFile(dest_path, minify=minify, previous=previous) as out:
+        for part in parts:
+            out.write(part)
+    return out.written, out.output, out.size
+
+
+def finish_write(result, write):
+    # Fill in what the writer thread did for a pipelined page
+    from_path, dest_path, error, written, output, timings, cache_changes, broken, asset_hashes, index = result
+    if write is not None:
+        try:
+            written, output, size = write.result()
+            if timings is not None:
+                timings["bytes"] = size
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            written = False
+    return from_path, dest_path, error, written, output, timings, cache_changes, broken, asset_hashes, index
+
+
+def render_pages_pipelined(tasks, io_threads, depth=PIPELINE_DEPTH):
+    # Pages are rendered one at a time on this thread, while io_threads
+    # threads read the next `depth` sources and write out up to `depth`
+    # finished pages, so slow storage doesn't stall the render
+    with ThreadPoolExecutor(max_workers=io_threads) as io:
+        reads = {}
 
-    htmlnode = markdown_to_html_node(contents)
-    html = htmlnode.to_html()
-    title = extract_title(contents)
+        def prefetch(index):
+            if index < len(tasks):
+                reads[index] = io.submit(read_source, tasks[index][0])
 
-    full_html = template.replace("{{ Title }}", title).replace("{{ Content }}", html)
+        for index in range(depth):
+            prefetch(index)
+        writes = deque()
+        for index, task in enumerate(tasks):
+            prefetch(index + depth)
+            parts = []
+            result = render_page(task, reads.pop(index), parts)
+            write = None
+            if result[2] is None and result[3] is None:
+                write = io.submit(write_output, task[2], parts, task[6], task[8])
+            writes.append((result, write))
+            while writes and (len(writes) > depth or writes[0][1] is None or writes[0][1].done()):
+                yield finish_write(*writes.popleft())
+        while writes:
+            yield finish_write(*writes.popleft())
 
-    full_html = full_html.replace('href="/', f'href="{basepath}')
-    full_html = full_html.replace('src="/', f'src="{basepath}')
 
-    destination.parent.mkdir(parents=True, exist_ok=True)
-    destination.write_text(full_html, encoding="utf-8")
+def render_pages(tasks, jobs=1, io_threads=0):
+    # Yields results as pages finish, in task order
+    workers = pool_size(jobs, len(tasks))
+    if workers == 1:
+        if io_threads:
+            yield from render_pages_pipelined(tasks, io_threads)
+            return
+        for task in tasks:
+            yield render_page(task)
+        return
 
+    # Hand out a few chunks per worker so slow pages don't leave cores idle
+    chunksize = max(1, len(tasks) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(render_cache.block_cache, urls.site_resolver)) as executor:
+        yield from executor.map(render_page, tasks, chunksize=chunksize)
 
 
+def generate_pages_recursive(dir_path_content, template_path, dest_dir_path, basepath, manifest=None, jobs=1,
+                             profiler=None, verbose=False, assets=None, io_threads=0, search=None, shard=None,
+                             minify=False, site_index=None):
+    pages = iter_pages(dir_path_content, dest_dir_path)
+    template = None
+    if site_index is not None:
+        # Every page's metadata is known before the first listing renders
+        pages = site_index.refresh(pages, dest_dir_path)
+        template = load_template(template_path, basepath, assets, minify)
 
-def generate_pages_recursive(dir_path_content, template_path, dest_dir_path, basepath):
-    # 1. Loop through everything in the content folder
-    for filename in os.listdir(dir_path_content):
-        # 2. Create the full paths
-        from_path = os.path.join(dir_path_content, filename)
-        
-        # 3. If it's a file, generate the page
-        if os.path.isfile(from_path):
-            # IMPORTANT: We want the destination to match the filename, but with .html
-            dest_filename = filename.replace(".md", ".html")
-            dest_path = os.path.join(dest_dir_path, dest_filename)
-            generate_page(from_path, template_path, dest_path, basepath)
-            
-        # 4. If it's a directory, recurse into it
-        elif os.path.isdir(from_path):
-            new_dest_dir = os.path.join(dest_dir_path, filename)
-            generate_pages_recursive(from_path, template_path, new_dest_dir, basepath)
+    # Links are checked against every page of the site, built this time or not
+    targets = set()
+    tasks = []
+    listings = {}
+    for from_path, dest_path in pages:
+        targets.add(urls.site_path(dest_path, dest_dir_path))
+        # A sharded build only renders its own share of the pages
+        if shard is not None and not in_shard(from_path, dir_path_content, shard):
+            continue
+        site_values = None
+        if site_index is not None:
+            # What the page shows of other pages is part of what makes it fresh
+            site_values = site_index.page_values(template, from_path, basepath)
+            listings[from_path] = values_digest(site_values)
+        # Skip pages whose source hasn't changed since the last build,
+        # unless the search index doesn't have them yet
+        if manifest is not None and manifest.is_fresh(from_path, dest_path, listings.get(from_path), assets):
+            if search is None or from_path in search.pages:
+                continue
+        previous = manifest.last_output(from_path) if manifest is not None else None
+        tasks.append((from_path, template_path, dest_path, basepath, profiler is not None, search is not None, minify,
+                      site_values, previous))
 
+    urls.set_site_resolver(UrlResolver(basepath, dest_dir_path, targets, assets=assets))
 
+    errors = []
+    generated = 0
+    written = 0
+    progress = Progress("Generating pages", len(tasks), verbose=verbose)
+    reset_dirs()
+    try:
+        results = render_pages(tasks, jobs, io_threads)
+        for result in results:
+            from_path, dest_path, error, page_written, output, timings, cache_changes, broken, asset_hashes, index = result
+            progress.update(f"Generating page {from_path} to {dest_path} using {template_path}")
+            if cache_changes is not None:
+                render_cache.block_cache.merge(cache_changes)
+            for url in broken:
+                print(f"Broken link in {from_path}: {url}")
+            if error is not None:
+                errors.append((from_path, error))
+                if manifest is not None:
+                    manifest.forget(from_path)
+                continue
+            if manifest is not None:
+                manifest.record(from_path, dest_path, listings.get(from_path), asset_hashes, output)
+            if profiler is not None:
+                profiler.add_page(from_path, timings)
+            if search is not None:
+                search.update(from_path, page_url(dest_path, dest_dir_path, basepath), index["title"], index["terms"])
+            generated += 1
+            written += page_written
+    finally:
+        urls.set_site_resolver(None)
+    progress.finish()
 
+    if errors:
+        raise BuildError(errors)
+    return generated, written
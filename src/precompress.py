@@ -0,0 +1,75 @@
+import gzip
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from copystatic import remove_empty_dirs
+from profiler import Progress
+from walk import walk_tree
+
+# Text outputs nginx's gzip_static will look for a .gz sibling of
+COMPRESSIBLE = {".html", ".css", ".js", ".mjs", ".json", ".svg", ".xml", ".txt", ".map"}
+
+
+def is_compressible(path):
+    return os.path.splitext(path)[1].lower() in COMPRESSIBLE
+
+
+def is_compressed(path, gz_path):
+    # The .gz gets its source's mtime, so an unchanged page or asset (which
+    # keeps its mtime) is never compressed again
+    try:
+        return os.stat(gz_path).st_mtime_ns == os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+
+def compress_file(path, level=9):
+    gz_path = path + ".gz"
+    tmp_path = gz_path + ".tmp"
+    stat = os.stat(path)
+    with open(path, "rb") as src, open(tmp_path, "wb") as raw:
+        # mtime=0 so the same input always gives the same .gz
+        with gzip.GzipFile(filename="", mode="wb", fileobj=raw, compresslevel=level, mtime=0) as dst:
+            shutil.copyfileobj(src, dst, 1 << 16)
+    os.utime(tmp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.replace(tmp_path, gz_path)
+    return stat.st_size, os.path.getsize(gz_path)
+
+
+def scan_outputs(directory):
+    # (files to compress, .gz files left over from files that are gone)
+    stale = []
+    orphans = []
+    for entry, relpath in walk_tree(directory):
+        if entry.name.endswith(".gz"):
+            source = entry.path[:-3]
+            if is_compressible(source) and not os.path.exists(source):
+                orphans.append(entry.path)
+        elif is_compressible(entry.name) and not is_compressed(entry.path, entry.path + ".gz"):
+            stale.append(entry.path)
+    return stale, orphans
+
+
+def precompress_tree(directory, level=9, jobs=0, verbose=False):
+    # Writes a .gz next to every text file in directory whose content changed
+    # since it was last compressed. zlib releases the GIL, so threads are enough.
+    directory = os.path.abspath(directory)
+    stale, orphans = scan_outputs(directory)
+    stats = {"compressed": 0, "removed": 0, "bytes": 0, "gz_bytes": 0}
+    for gz_path in orphans:
+        os.remove(gz_path)
+        stats["removed"] += 1
+        # The page's directory was kept around only for its .gz
+        remove_empty_dirs(os.path.dirname(gz_path), directory)
+
+    progress = Progress("Compressing", len(stale), verbose=verbose)
+    workers = jobs or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for path, (size, gz_size) in zip(stale, executor.map(lambda path: compress_file(path, level), stale)):
+            progress.update(f"Compressing: {path}")
+            stats["compressed"] += 1
+            stats["bytes"] += size
+            stats["gz_bytes"] += gz_size
+    progress.finish()
+    return stats
@@ -0,0 +1,129 @@
+import csv
+import json
+import sys
+import time
+
+
+class Progress:
+    # Replaces one print per file: a summary line at most every `interval`
+    # seconds, or every item when verbose
+    def __init__(self, label, total=None, interval=1.0, verbose=False, stream=None):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.verbose = verbose
+        self.stream = stream if stream is not None else sys.stdout
+        self.done = 0
+        self.start = time.perf_counter()
+        self.last_report = self.start
+
+    def update(self, message=None):
+        self.done += 1
+        if self.verbose:
+            if message is not None:
+                print(message, file=self.stream)
+            return
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            self.report(now)
+
+    def report(self, now):
+        rate = self.done / max(now - self.start, 1e-9)
+        total = f"/{self.total}" if self.total is not None else ""
+        print(f"{self.label}: {self.done}{total} ({rate:.0f}/s)", file=self.stream, flush=True)
+
+    def finish(self):
+        if not self.verbose and self.done:
+            self.report(time.perf_counter())
+
+
+class PageTimer:
+    # Per-page stage timings, cheap enough to leave on while profiling
+    def __init__(self):
+        self.timings = {}
+        self.bytes = 0
+        self.write_seconds = 0.0
+        self.last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.timings[stage] = self.timings.get(stage, 0.0) + now - self.last
+        self.last = now
+
+    def writer(self, write):
+        # Time spent inside write() is "write", the rest of streaming is "render"
+        def timed_write(text):
+            start = time.perf_counter()
+            write(text)
+            self.write_seconds += time.perf_counter() - start
+        return timed_write
+
+    def finish_stream(self):
+        self.lap("render")
+        self.timings["render"] -= self.write_seconds
+        self.timings["write"] = self.timings.get("write", 0.0) + self.write_seconds
+        self.write_seconds = 0.0
+
+    def result(self):
+        result = dict(self.timings)
+        result["bytes"] = self.bytes
+        return result
+
+
+class Profiler:
+    def __init__(self):
+        # name -> {"seconds", "bytes", "count"}
+        self.stages = {}
+        # one dict per page: path, seconds, bytes and a key per stage
+        self.pages = []
+        self.start = time.perf_counter()
+
+    def add_stage(self, name, seconds, size=0, count=1):
+        stage = self.stages.setdefault(name, {"seconds": 0.0, "bytes": 0, "count": 0})
+        stage["seconds"] += seconds
+        stage["bytes"] += size
+        stage["count"] += count
+
+    def add_page(self, path, timings):
+        page = {"path": path, "seconds": 0.0, "bytes": timings.get("bytes", 0)}
+        for name, seconds in timings.items():
+            if name == "bytes":
+                continue
+            page[name] = seconds
+            page["seconds"] += seconds
+            self.add_stage(name, seconds, page["bytes"] if name == "write" else 0)
+        self.pages.append(page)
+
+    def slowest(self, count):
+        return sorted(self.pages, key=lambda page: page["seconds"], reverse=True)[:count]
+
+    def report(self, top=10):
+        return {
+            "wall_seconds": time.perf_counter() - self.start,
+            "stages": self.stages,
+            "slowest": self.slowest(top),
+            "pages": self.pages,
+        }
+
+    def write(self, path, top=10):
+        # .csv gets one row per page, anything else the full json report
+        if path.endswith(".csv"):
+            stage_names = sorted({name for page in self.pages for name in page} - {"path", "seconds", "bytes"})
+            with open(path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.DictWriter(f, ["path", "seconds", "bytes"] + stage_names, restval=0)
+                writer.writeheader()
+                writer.writerows(self.pages)
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(self.report(top), f, indent=2)
+
+    def summary(self, top=10):
+        lines = [f"{'stage':<14}{'seconds':>10}{'bytes':>14}"]
+        for name, stage in self.stages.items():
+            lines.append(f"{name:<14}{stage['seconds']:>10.3f}{stage['bytes']:>14}")
+        if self.pages:
+            lines.append(f"slowest {min(top, len(self.pages))} pages:")
+            for page in self.slowest(top):
+                lines.append(f"  {page['seconds'] * 1000:>9.2f} ms  {page['path']}")
+        return "\n".join(lines)
@@ -0,0 +1,136 @@
+import hashlib
+import os
+import pickle
+import posixpath
+import re
+from collections import OrderedDict
+
+from block import block_to_html
+from manifest import RENDERER_VERSION
+from urls import is_external
+
+BLOCK_CACHE_PATH = "./.cache/blocks.pickle"
+
+# The urls of a block's links and images, loosely: only used to tell
+# whether any of them is relative
+MARKDOWN_URL = re.compile(r"\]\(([^)\s]*)")
+
+# The cache generate_page renders through, set with set_block_cache.
+# Worker processes get their own copy and report back what they added.
+block_cache = None
+
+
+def set_block_cache(cache):
+    global block_cache
+    block_cache = cache
+
+
+def block_key(block, block_type, url_key="/"):
+    # url_key is from resolver_key: the resolver's basepath, whether it
+    # fingerprints assets, and the page's directory if that matters
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(url_key.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(block_type.value.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(block.encode("utf-8"))
+    return digest.digest()
+
+
+def resolver_key(block, resolver):
+    # Relative urls of fingerprinted assets resolve against the page's
+    # directory, so a block with one is only shared by pages next to each other
+    if resolver.assets is None or resolver.page is None or "](" not in block:
+        return resolver.cache_key
+    for url in MARKDOWN_URL.findall(block):
+        if not url.startswith("/") and not is_external(url):
+            return f"{resolver.cache_key}\0{posixpath.dirname(resolver.page)}"
+    return resolver.cache_key
+
+
+class BlockCache:
+    # Rendered html of a block, keyed by a hash of its text and type, so the
+    # same disclaimer or code sample is only rendered once across pages.
+    # Each entry also keeps the links in the block, so a hit still checks
+    # them against the page it lands on, and the static files it looked up:
+    # it's only a hit while those are the same
+    def __init__(self, max_entries=4096, path=None):
+        self.max_entries = max_entries
+        self.path = path
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # What this process rendered since the last take_changes()
+        self.added = []
+
+    def render(self, block, block_type, resolver=None):
+        key = block_key(block, block_type, resolver_key(block, resolver) if resolver is not None else "/")
+        entry = self.entries.get(key)
+        if entry is not None and (not entry[2] or resolver.assets.is_current(entry[2])):
+            self.entries.move_to_end(key)
+            self.hits += 1
+            html, links, asset_hashes = entry
+            if resolver is not None:
+                for url in links:
+                    resolver.check(url)
+                resolver.asset_hashes.extend(asset_hashes)
+            return html
+
+        self.misses += 1
+        first_link = len(resolver.links) if resolver is not None else 0
+        first_asset = len(resolver.asset_hashes) if resolver is not None else 0
+        html = block_to_html(block, block_type, resolver).to_html()
+        links = tuple(resolver.links[first_link:]) if resolver is not None else ()
+        asset_hashes = tuple(resolver.asset_hashes[first_asset:]) if resolver is not None else ()
+        self.store(key, (html, links, asset_hashes))
+        self.added.append((key, (html, links, asset_hashes)))
+        return html
+
+    def store(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def take_changes(self):
+        changes = {"entries": self.added, "hits": self.hits, "misses": self.misses}
+        self.added = []
+        self.hits = 0
+        self.misses = 0
+        return changes
+
+    def merge(self, changes):
+        # Fold in what a worker process rendered
+        for key, entry in changes["entries"]:
+            self.store(key, entry)
+        self.hits += changes["hits"]
+        self.misses += changes["misses"]
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def load(self):
+        if self.path is None:
+            return
+        try:
+            with open(self.path, "rb") as f:
+                version, entries = pickle.load(f)
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            return
+        # Entries from another renderer version can't be trusted
+        if version != RENDERER_VERSION:
+            return
+        for key, entry in entries:
+            self.store(key, entry)
+
+    def save(self):
+        if self.path is None:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump((RENDERER_VERSION, list(self.entries.items())), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
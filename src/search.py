@@ -0,0 +1,215 @@
+import json
+import os
+import re
+from collections import Counter
+
+from block import BlockType
+from output import OutputFile, make_dirs
+
+SEARCH_STATE_PATH = "./.cache/search-index.json"
+# Terms are sharded by their first characters, so a query only downloads
+# the shards of its own terms
+SHARD_PREFIX = 2
+
+WORD = re.compile(r"[^\W_]+")
+# ](url) of links and images: the url isn't something people search for
+LINK_URL = re.compile(r"\]\([^)]*\)")
+
+# Loaded next to the shards: search("ring power").then(results => ...)
+SEARCH_JS = """const searchBase = new URL(".", document.currentScript.src);
+let searchMeta = null;
+const searchShards = {};
+
+function readVarint(bytes, state) {
+  let value = 0, shift = 0, byte;
+  do {
+    byte = bytes[state.pos++];
+    value += (byte & 0x7f) * 2 ** shift;
+    shift += 7;
+  } while (byte & 0x80);
+  return value;
+}
+
+function decodeShard(bytes) {
+  const terms = new Map(), state = { pos: 0 }, decoder = new TextDecoder();
+  const count = readVarint(bytes, state);
+  for (let i = 0; i < count; i++) {
+    const length = readVarint(bytes, state);
+    const term = decoder.decode(bytes.subarray(state.pos, state.pos + length));
+    state.pos += length;
+    const postings = [];
+    let page = 0;
+    const n = readVarint(bytes, state);
+    for (let j = 0; j < n; j++) postings.push([page += readVarint(bytes, state), 0]);
+    for (let j = 0; j < n; j++) postings[j][1] = readVarint(bytes, state);
+    terms.set(term, postings);
+  }
+  return terms;
+}
+
+async function loadShard(name) {
+  if (!(name in searchShards)) {
+    searchShards[name] = searchMeta.shards.includes(name)
+      ? fetch(new URL(name + ".bin", searchBase)).then(r => r.arrayBuffer()).then(b => decodeShard(new Uint8Array(b)))
+      : Promise.resolve(new Map());
+  }
+  return searchShards[name];
+}
+
+async function search(query) {
+  if (!searchMeta) searchMeta = await fetch(new URL("meta.json", searchBase)).then(r => r.json());
+  const words = query.toLowerCase().match(/[\\p{L}\\p{N}]+/gu) || [];
+  let scores = null;
+  for (const word of words) {
+    const found = new Map();
+    for (const shard of await Promise.all(wordShards(word).map(loadShard))) {
+      for (const [term, postings] of shard) {
+        if (!term.startsWith(word)) continue;
+        for (const [page, count] of postings) found.set(page, (found.get(page) || 0) + count);
+      }
+    }
+    // Every word has to match (as a prefix of some term on the page)
+    scores = scores === null ? found : new Map([...found].filter(([page]) => scores.has(page))
+      .map(([page, count]) => [page, count + scores.get(page)]));
+  }
+  return [...(scores || [])].sort((a, b) => b[1] - a[1])
+    .map(([page, score]) => ({ url: searchMeta.pages[page][0], title: searchMeta.pages[page][1], score }));
+}
+
+function shardName(term) {
+  return [...term].slice(0, %d).map(c => /[a-z0-9]/.test(c) ? c : "_").join("");
+}
+
+function wordShards(word) {
+  // A word shorter than a shard name can start terms of every shard
+  // whose name starts with it
+  const name = shardName(word);
+  if ([...word].length >= %d) return [name];
+  return searchMeta.shards.filter(shard => shard.startsWith(name));
+}
+""" % (SHARD_PREFIX, SHARD_PREFIX)
+
+
+def page_terms(typed_blocks):
+    # term -> how often it appears on the page, code blocks left out
+    terms = Counter()
+    for block, block_type, line_number in typed_blocks:
+        add_terms(terms, block, block_type)
+    return dict(terms)
+
+
+def add_terms(terms, block, block_type):
+    if block_type != BlockType.CODE:
+        terms.update(WORD.findall(LINK_URL.sub("]", block).lower()))
+
+
+def shard_name(term):
+    return "".join(c if "a" <= c <= "z" or "0" <= c <= "9" else "_" for c in term[:SHARD_PREFIX])
+
+
+def encode_varint(value, out):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def encode_shard(postings):
+    # postings: term -> sorted [(page id, count)]. Per term: the term, then
+    # the page ids delta-encoded, then the counts, all as varints
+    out = bytearray()
+    encode_varint(len(postings), out)
+    for term in sorted(postings):
+        data = term.encode("utf-8")
+        encode_varint(len(data), out)
+        out += data
+        encode_varint(len(postings[term]), out)
+        previous = 0
+        for page_id, count in postings[term]:
+            encode_varint(page_id - previous, out)
+            previous = page_id
+        for page_id, count in postings[term]:
+            encode_varint(count, out)
+    return bytes(out)
+
+
+class SearchIndex:
+    # Every page's title, url and terms, kept in .cache/ so a build only
+    # tokenizes the pages it rebuilt. Page ids are stable across builds, so
+    # adding a page only changes the shards of its own terms.
+    def __init__(self, path=SEARCH_STATE_PATH, pages=None, ids=None):
+        self.path = path
+        # from_path -> {"url", "title", "terms"}
+        self.pages = pages if pages is not None else {}
+        # from_path -> page id
+        self.ids = ids if ids is not None else {}
+        # Ids of removed pages, to hand out again (smallest last)
+        used = set(self.ids.values())
+        self.free = sorted(set(range(max(used) + 1 if used else 0)) - used, reverse=True)
+
+    @classmethod
+    def load(cls, path=SEARCH_STATE_PATH):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return cls(path)
+        return cls(path, data["pages"], data["ids"])
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"pages": self.pages, "ids": self.ids}, f)
+        os.replace(tmp_path, self.path)
+
+    def update(self, from_path, url, title, terms):
+        self.pages[from_path] = {"url": url, "title": title, "terms": terms}
+        if from_path not in self.ids:
+            # Reuse the id of a removed page before growing the list
+            self.ids[from_path] = self.free.pop() if self.free else len(self.ids)
+
+    def retain(self, from_paths):
+        for from_path in list(self.pages):
+            if from_path not in from_paths:
+                del self.pages[from_path]
+                self.free.append(self.ids.pop(from_path))
+        self.free.sort(reverse=True)
+
+    def shards(self):
+        # shard name -> {term: [(page id, count)]}
+        shards = {}
+        for from_path, page in self.pages.items():
+            page_id = self.ids[from_path]
+            for term, count in page["terms"].items():
+                shards.setdefault(shard_name(term), {}).setdefault(term, []).append((page_id, count))
+        for postings in shards.values():
+            for term_postings in postings.values():
+                term_postings.sort()
+        return shards
+
+    def write(self, directory):
+        # Writes meta.json, search.js and one .bin per shard into directory.
+        # Files that come out the same aren't touched, and shards nothing
+        # maps to any more are removed. Returns how many files changed.
+        make_dirs(directory)
+        shards = self.shards()
+        page_list = [None] * (max(self.ids.values()) + 1 if self.ids else 0)
+        for from_path, page_id in self.ids.items():
+            page_list[page_id] = [self.pages[from_path]["url"], self.pages[from_path]["title"]]
+        meta = json.dumps({"pages": page_list, "shards": sorted(shards)}, ensure_ascii=False, separators=(",", ":"))
+
+        changed = 0
+        files = [("meta.json", meta, False), ("search.js", SEARCH_JS, False)]
+        files += [(f"{name}.bin", encode_shard(postings), True) for name, postings in shards.items()]
+        for filename, data, binary in files:
+            with OutputFile(os.path.join(directory, filename), binary=binary) as out:
+                out.write(data)
+            changed += out.written
+        for filename in os.listdir(directory):
+            if filename.endswith(".bin") and filename[:-4] not in shards:
+                os.remove(os.path.join(directory, filename))
+                changed += 1
+        return changed
@@ -0,0 +1,234 @@
+import argparse
+import hashlib
+import json
+import os
+
+from build import build_site
+from copystatic import place_file, remove_empty_dirs, load_synced, save_synced, sync_files_recursive
+from assets import AssetManifest, ASSET_MANIFEST_NAME
+from manifest import RENDERER_VERSION, hash_file, make_build_key
+from page_generator import find_pages, page_key, in_shard
+from precompress import precompress_tree
+from template import load_template
+
+# Each shard renders into its own directory, to be gathered (from CI
+# artifacts, say) and merged into docs/ by `main.py merge`
+SHARDS_DIR = "./shards"
+SHARD_MANIFEST_NAME = "shard-manifest.json"
+MERGE_MANIFEST_PATH = "./.cache/merged-pages.json"
+# What build_shard writes into every shard manifest
+SHARD_FIELDS = ("shard", "build_key", "page_count", "pages_digest", "pages")
+
+
+class ShardError(Exception):
+    def __init__(self, problems):
+        self.problems = problems
+        super().__init__("\n".join([f"{len(problems)} problem(s) merging shards:"] + [f"  {p}" for p in problems]))
+
+
+def parse_shard(spec):
+    # "2/4" -> (2, 4), for argparse
+    try:
+        index, count = (int(part) for part in spec.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got {spec!r}")
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"shard {index} is not between 1 and {count}")
+    return index, count
+
+
+def shard_dir(shard):
+    return os.path.join(SHARDS_DIR, f"{shard[0]}-of-{shard[1]}")
+
+
+def shard_build_key(template_path, basepath, assets=None, minify=False):
+    # Like site_build_key, minus the output path, which differs between shards.
+    # It only tells whether shards are of the same site, not which pages are
+    # stale, so every static file counts
+    template = load_template(template_path, basepath, assets)
+    return make_build_key(
+        RENDERER_VERSION,
+        basepath,
+        assets.digest if assets is not None else "",
+        "minify" if minify else "",
+        *[hash_file(path) for path, _ in template.dependencies],
+    )
+
+
+def pages_digest(keys):
+    return hashlib.sha256("\n".join(sorted(keys)).encode("utf-8")).hexdigest()
+
+
+def build_shard(dir_path_content, template_path, basepath, shard, assets=None, dest_dir_path=None, manifest_path=None,
+                minify=False, **kwargs):
+    # Renders this shard's pages into shard_dir(shard) and records what it
+    # built, and which site it was part of, in the shard manifest
+    if dest_dir_path is None:
+        dest_dir_path = shard_dir(shard)
+    if manifest_path is None:
+        manifest_path = os.path.join(".cache", f"build-manifest-{shard[0]}-of-{shard[1]}.json")
+    build_site(dir_path_content, template_path, dest_dir_path, basepath, manifest_path, assets=assets, shard=shard,
+               minify=minify, **kwargs)
+
+    all_pages = find_pages(dir_path_content, dest_dir_path)
+    pages = {}
+    for from_path, dest_path in all_pages:
+        if in_shard(from_path, dir_path_content, shard):
+            pages[os.path.relpath(dest_path, dest_dir_path).replace(os.sep, "/")] = {
+                "source": page_key(from_path, dir_path_content),
+                "hash": hash_file(dest_path),
+            }
+    data = {
+        "shard": list(shard),
+        "build_key": shard_build_key(template_path, basepath, assets, minify),
+        "page_count": len(all_pages),
+        "pages_digest": pages_digest(page_key(from_path, dir_path_content) for from_path, _ in all_pages),
+        "pages": pages,
+    }
+    with open(os.path.join(dest_dir_path, SHARD_MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+    print(f"Shard {shard[0]}/{shard[1]}: {len(pages)} of {len(all_pages)} pages in {dest_dir_path}")
+    return data
+
+
+def load_shard_manifests(shard_dirs):
+    manifests = []
+    problems = []
+    for directory in shard_dirs:
+        path = os.path.join(directory, SHARD_MANIFEST_NAME)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            problems.append(f"{path}: {e}")
+            continue
+        shard_problems = check_shard_manifest(data)
+        problems.extend(f"{path}: {problem}" for problem in shard_problems)
+        if not shard_problems:
+            manifests.append((directory, data))
+    return manifests, problems
+
+
+def check_shard_manifest(data):
+    # A truncated or hand-edited manifest is reported, not a KeyError
+    if not isinstance(data, dict):
+        return ["shard manifest is not a JSON object"]
+    problems = [f"shard manifest missing field {field}" for field in SHARD_FIELDS if field not in data]
+    if problems:
+        return problems
+    shard = data["shard"]
+    if not (isinstance(shard, list) and len(shard) == 2 and all(isinstance(n, int) for n in shard)):
+        problems.append(f"shard manifest field shard is {shard!r}, not [i, N]")
+    if not isinstance(data["page_count"], int):
+        problems.append(f"shard manifest field page_count is {data['page_count']!r}, not a number")
+    if not isinstance(data["pages"], dict):
+        problems.append("shard manifest field pages is not an object")
+    else:
+        for relpath, page in data["pages"].items():
+            if not isinstance(page, dict) or "hash" not in page:
+                problems.append(f"shard manifest page {relpath} missing field hash")
+    return problems
+
+
+def check_shards(manifests):
+    # Every shard of the same site, each exactly once, with every page built
+    # once (or built the same by two shards)
+    problems = []
+    if not manifests:
+        return ["no shards given"], {}
+    first = manifests[0][1]
+    count = first["shard"][1]
+    seen = {}
+    for directory, data in manifests:
+        index, shard_count = data["shard"]
+        if shard_count != count:
+            problems.append(f"{directory}: shard {index}/{shard_count} of a {count}-way build")
+        elif index in seen:
+            problems.append(f"{directory}: shard {index}/{count} already merged from {seen[index]}")
+        seen[index] = directory
+        for key in ("build_key", "pages_digest"):
+            if data[key] != first[key]:
+                problems.append(f"{directory}: {key} differs from {manifests[0][0]} "
+                                "(different template, basepath, assets or pages)")
+    for index in range(1, count + 1):
+        if index not in seen:
+            problems.append(f"shard {index}/{count} is missing")
+
+    owners = {}
+    for directory, data in manifests:
+        for relpath, page in data["pages"].items():
+            if relpath in owners and owners[relpath][1]["hash"] != page["hash"]:
+                problems.append(f"{relpath}: {owners[relpath][0]} and {directory} built different pages")
+            owners.setdefault(relpath, (directory, page))
+            if not os.path.isfile(os.path.join(directory, relpath)):
+                problems.append(f"{relpath}: listed by {directory} but not there")
+    if len(owners) != first["page_count"]:
+        problems.append(f"{first['page_count'] - len(owners)} page(s) missing from every shard")
+    return problems, owners
+
+
+def merge_shards(shard_dirs, dest_dir_path, link="auto", merge_manifest_path=MERGE_MANIFEST_PATH):
+    # Checks the shards fit together, then places every page in dest_dir_path.
+    # Pages already there with the same content are left alone, and pages of
+    # an earlier merge that no shard has any more are removed.
+    manifests, problems = load_shard_manifests(shard_dirs)
+    if not problems:
+        problems, owners = check_shards(manifests)
+    if problems:
+        raise ShardError(problems)
+
+    destination = os.path.abspath(dest_dir_path)
+    stats = {"copied": 0, "unchanged": 0, "removed": 0}
+    for relpath, (directory, page) in sorted(owners.items()):
+        dest_path = os.path.join(destination, relpath)
+        if os.path.isfile(dest_path) and hash_file(dest_path) == page["hash"]:
+            stats["unchanged"] += 1
+            continue
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        place_file(os.path.join(directory, relpath), dest_path, link)
+        stats["copied"] += 1
+
+    merged = set(owners)
+    for relpath in sorted(load_synced(merge_manifest_path) - merged):
+        stale_path = os.path.join(destination, relpath)
+        if os.path.isfile(stale_path):
+            os.remove(stale_path)
+            stats["removed"] += 1
+            remove_empty_dirs(os.path.dirname(stale_path), destination)
+    save_synced(merge_manifest_path, merged)
+    return stats
+
+
+def merge_main(argv, dir_path_static, dest_dir_path):
+    parser = argparse.ArgumentParser(prog="main.py merge",
+                                     description="Check shard outputs fit together and merge them into docs/")
+    parser.add_argument("shards", nargs="*", help=f"shard output directories (default: every one in {SHARDS_DIR})")
+    parser.add_argument("--link", choices=["auto", "reflink", "hardlink", "copy"], default="auto")
+    parser.add_argument("--checksum", action="store_true")
+    parser.add_argument("--fingerprint", action="store_true", help="the shards were built with --fingerprint")
+    parser.add_argument("--gzip", nargs="?", type=int, const=9, choices=range(1, 10), metavar="LEVEL")
+    args = parser.parse_args(argv)
+    shard_dirs = args.shards
+    if not shard_dirs and os.path.isdir(SHARDS_DIR):
+        shard_dirs = sorted(os.path.join(SHARDS_DIR, name) for name in os.listdir(SHARDS_DIR))
+
+    # Pages first: if the shards don't fit together docs/ isn't touched at all
+    try:
+        stats = merge_shards(shard_dirs, dest_dir_path, args.link)
+    except ShardError as e:
+        raise SystemExit(str(e))
+    print(f"Pages: {stats['copied']} copied, {stats['unchanged']} unchanged, {stats['removed']} removed")
+
+    # The static files are copied once, here, not by every shard
+    assets = None
+    asset_manifest_path = os.path.join(dest_dir_path, ASSET_MANIFEST_NAME)
+    if args.fingerprint:
+        assets = AssetManifest.build(dir_path_static, AssetManifest.load(asset_manifest_path))
+    stats = sync_files_recursive(dir_path_static, dest_dir_path, checksum=args.checksum, link=args.link,
+                                 names=assets.names() if assets is not None else None)
+    print(f"Static files: {stats['copied']} copied, {stats['unchanged']} unchanged, {stats['removed']} removed")
+    if assets is not None:
+        assets.save(asset_manifest_path)
+    if args.gzip is not None:
+        stats = precompress_tree(dest_dir_path, args.gzip)
+        print(f"Compressed {stats['compressed']} files, {stats['removed']} stale .gz removed")
@@ -0,0 +1,154 @@
+import os
+import re
+
+from urls import UrlResolver, URL_ATTRIBUTE
+from minify import minify_segments
+
+# {{ Name }} is a slot filled per page, {{> file.html }} is a partial that
+# gets inlined when the template is compiled. Slots can take arguments,
+# like {{ Recent 5 }} or {{ Pages /blog/ }}
+TAG_PATTERN = re.compile(r"\{\{\s*(>)?\s*([\w./-]+)((?:\s+[\w./:-]+)*)\s*\}\}")
+
+# Compiled templates, keyed by (abspath, basepath, asset manifest digest, minify)
+compiled_templates = {}
+
+
+class Slot:
+    def __init__(self, name, raw, args=()):
+        self.name = name
+        # The original tag, used as-is when a page doesn't fill this slot
+        self.raw = raw
+        self.args = tuple(args)
+        # What a page's values are looked up by: "Title", "Recent 5"
+        self.key = " ".join((name,) + self.args)
+
+    def __eq__(self, other):
+        return isinstance(other, Slot) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return f"Slot({self.key})"
+
+
+class Template:
+    def __init__(self, segments, dependencies=None, asset_hashes=()):
+        # segments alternate between static strings and Slots
+        self.segments = segments
+        # (path, mtime_ns) of the template and every partial it pulled in
+        self.dependencies = dependencies if dependencies is not None else []
+        # (site path, hash) of the fingerprinted files its urls point at
+        self.asset_hashes = tuple(asset_hashes)
+
+    def slots(self):
+        return [segment for segment in self.segments if isinstance(segment, Slot)]
+
+    def render(self, values):
+        parts = []
+        self.write(parts.append, values)
+        return "".join(parts)
+
+    def write(self, write, values):
+        # A value can also be a function that streams itself into write,
+        # so big slots like the page content never exist as one string
+        for segment in self.segments:
+            if isinstance(segment, Slot):
+                value = values.get(segment.key, segment.raw)
+                if callable(value):
+                    value(write)
+                else:
+                    write(value)
+            else:
+                write(segment)
+
+    def is_current(self):
+        for path, mtime in self.dependencies:
+            try:
+                if os.stat(path).st_mtime_ns != mtime:
+                    return False
+            except OSError:
+                return False
+        return True
+
+
+def rewrite_basepath(html, basepath):
+    # Only for the template's own markup: urls in page content are resolved
+    # by a UrlResolver, raw html in the markdown included
+    if basepath == "/":
+        return html
+    html = html.replace('href="/', f'href="{basepath}')
+    return html.replace('src="/', f'src="{basepath}')
+
+
+def rewrite_urls(html, resolver):
+    # With fingerprinted assets, each url has to be looked up on its own
+    return URL_ATTRIBUTE.sub(lambda m: f'{m.group(1)}="{resolver.rewrite(m.group(2))}"', html)
+
+
+def parse_template(text, base_dir=".", dependencies=None, stack=()):
+    segments = []
+    position = 0
+    for match in TAG_PATTERN.finditer(text):
+        segments.append(text[position:match.start()])
+        name = match.group(2)
+        if match.group(1):
+            partial_path = os.path.abspath(os.path.join(base_dir, name))
+            if partial_path in stack:
+                raise ValueError(f"partial {name} includes itself")
+            if dependencies is not None:
+                dependencies.append((partial_path, os.stat(partial_path).st_mtime_ns))
+            with open(partial_path, "r", encoding="utf-8") as f:
+                partial_text = f.read()
+            partial = parse_template(partial_text, os.path.dirname(partial_path), dependencies, stack + (partial_path,))
+            segments.extend(partial)
+        else:
+            segments.append(Slot(name, match.group(0), match.group(3).split()))
+        position = match.end()
+    segments.append(text[position:])
+    return segments
+
+
+def merge_segments(segments):
+    # Join neighbouring static strings so render does one append per slot
+    merged = []
+    for segment in segments:
+        if isinstance(segment, str):
+            if segment == "":
+                continue
+            if merged and isinstance(merged[-1], str):
+                merged[-1] += segment
+                continue
+        merged.append(segment)
+    return merged
+
+
+def compile_template(text, basepath="/", base_dir=".", dependencies=None, assets=None, minify=False):
+    segments = merge_segments(parse_template(text, base_dir, dependencies))
+    # The basepath (and asset) rewrite of the template itself happens once, here
+    resolver = UrlResolver(basepath, assets=assets)
+    if assets is None:
+        rewrite = lambda html: rewrite_basepath(html, basepath)
+    else:
+        rewrite = lambda html: rewrite_urls(html, resolver)
+    segments = [rewrite(s) if isinstance(s, str) else s for s in segments]
+    if minify:
+        # The template's indentation goes here, not on every page
+        segments = merge_segments(minify_segments(segments))
+    return Template(segments, dependencies, resolver.asset_hashes)
+
+
+def load_template(template_path, basepath="/", assets=None, minify=False):
+    path = os.path.abspath(template_path)
+    key = (path, basepath, assets.digest if assets is not None else None, minify)
+    template = compiled_templates.get(key)
+    if template is not None and template.is_current():
+        return template
+
+    # stat before reading, so an edit while we compile is picked up next time
+    dependencies = [(path, os.stat(path).st_mtime_ns)]
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    template = compile_template(text, basepath, os.path.dirname(path), dependencies, assets, minify)
+    compiled_templates[key] = template
+    return template
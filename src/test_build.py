@@ -0,0 +1,747 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+
+from build import build_site
+from page_generator import BuildError, generate_page
+import page_generator
+import output
+from copystatic import sync_files_recursive
+from corpus import CorpusSpec, generate_corpus
+from profiler import Profiler
+from devserver import DevServer, Reloader, make_handler, snapshot, diff_snapshots, PollingWatcher, EventWatcher
+import devserver
+from render_cache import BlockCache
+from precompress import precompress_tree
+from assets import AssetManifest
+from search import SearchIndex
+from shard import build_shard, merge_shards, ShardError
+from daemon import BuildDaemon, make_api_handler
+from metadata import SiteIndex
+from check import check_site
+
+
+TEMPLATE = "<title>{{ Title }}</title><a href=\"/\">home</a>{{ Content }}"
+
+
+class TestBuild(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        self.content = os.path.join(self.root, "content")
+        self.docs = os.path.join(self.root, "docs")
+        self.template = os.path.join(self.root, "template.html")
+        self.manifest = os.path.join(self.root, ".cache", "manifest.json")
+        self.write(self.template, TEMPLATE)
+        self.write(os.path.join(self.content, "index.md"), "# Home\n\nhello")
+        self.write(os.path.join(self.content, "blog", "post", "index.md"), "# Post\n\nworld")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, path, text):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def read(self, path):
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+
+    def build(self, basepath="/", **kwargs):
+        with redirect_stdout(StringIO()):
+            return build_site(self.content, self.template, self.docs, basepath, self.manifest, **kwargs)
+
+    def test_build_writes_pages(self):
+        self.assertEqual(self.build(), 2)
+        html = self.read(os.path.join(self.docs, "blog", "post", "index.html"))
+        self.assertEqual(html, '<title>Post</title><a href="/">home</a><div><h1>Post</h1><p>world</p></div>')
+
+    def test_streamed_large_page_matches_document(self):
+        source = os.path.join(self.content, "big.md")
+        self.write(source, "---\ndate: 1\n---\nintro **text**\n\n# Big\n\nsome words\n\n```\ncode words\n```\n\n- more words")
+        pages = []
+        limit = page_generator.LARGE_PAGE_BYTES
+        for large in (1 << 30, 0):
+            page_generator.LARGE_PAGE_BYTES = large
+            try:
+                index = {}
+                dest = os.path.join(self.docs, f"big{large}.html")
+                generate_page(source, self.template, dest, "/", index=index)
+            finally:
+                page_generator.LARGE_PAGE_BYTES = limit
+            pages.append((self.read(dest), index))
+        self.assertEqual(pages[0], pages[1])
+        self.assertEqual(pages[1][1]["terms"]["words"], 2)
+
+    def test_only_markdown_files_are_pages(self):
+        self.write(os.path.join(self.content, "blog", "notes.txt"), "not a page")
+        self.write(os.path.join(self.content, "blog", "post", "index.md.bak"), "# Old")
+        self.assertEqual(self.build(), 2)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.docs, "blog"))), ["post"])
+
+    def test_incremental_skips_unchanged_pages(self):
+        self.build()
+        self.assertEqual(self.build(), 0)
+        self.write(os.path.join(self.content, "index.md"), "# Home\n\nchanged")
+        self.assertEqual(self.build(), 1)
+        self.assertIn("changed", self.read(os.path.join(self.docs, "index.html")))
+
+    def test_template_and_basepath_changes_rebuild_everything(self):
+        self.build()
+        self.assertEqual(self.build("/site/"), 2)
+        self.write(self.template, TEMPLATE + "<footer></footer>")
+        self.assertEqual(self.build("/site/"), 2)
+        self.assertEqual(self.build("/site/", force=True), 2)
+
+    def test_deleted_source_removes_output(self):
+        self.build()
+        os.remove(os.path.join(self.content, "blog", "post", "index.md"))
+        self.build()
+        self.assertFalse(os.path.exists(os.path.join(self.docs, "blog", "post", "index.html")))
+        self.assertTrue(os.path.exists(os.path.join(self.docs, "index.html")))
+
+    def test_missing_output_is_rebuilt(self):
+        self.build()
+        os.remove(os.path.join(self.docs, "index.html"))
+        self.assertEqual(self.build(), 1)
+
+    def test_parallel_build_matches_serial(self):
+        self.build(jobs=1)
+        serial = self.read(os.path.join(self.docs, "blog", "post", "index.html"))
+        self.assertEqual(self.build(force=True, jobs=2), 2)
+        self.assertEqual(self.read(os.path.join(self.docs, "blog", "post", "index.html")), serial)
+
+    def test_pipelined_build_matches_serial(self):
+        self.write(os.path.join(self.content, "bad.md"), "# Bad\n\n**unclosed")
+        with self.assertRaises(BuildError):
+            self.build(jobs=1)
+        serial = self.read(os.path.join(self.docs, "blog", "post", "index.html"))
+        os.remove(os.path.join(self.docs, "blog", "post", "index.html"))
+        with self.assertRaises(BuildError) as cm:
+            self.build(force=True, jobs=1, io_threads=2)
+        self.assertEqual([os.path.basename(path) for path, _ in cm.exception.errors], ["bad.md"])
+        self.assertEqual(self.read(os.path.join(self.docs, "blog", "post", "index.html")), serial)
+        self.assertFalse(os.path.exists(os.path.join(self.docs, "bad.html")))
+
+    def test_minified_build(self):
+        self.write(self.template, "<html>\n  <title>{{ Title }}</title>\n  <body>\n    {{ Content }}\n  </body>\n</html>\n")
+        self.write(os.path.join(self.content, "blog", "post", "index.md"), "# Post\n\n```\nif x:\n    y\n```")
+        self.build()
+        self.assertEqual(self.build(minify=True), 2)
+        post = os.path.join(self.docs, "blog", "post", "index.html")
+        minified = "<html><title>Post</title><body><div><h1>Post</h1><pre><code>if x:\n    y\n</code></pre></div></body></html>"
+        self.assertEqual(self.read(post), minified)
+        # The pipelined writer minifies on its thread, to the same bytes
+        os.remove(post)
+        self.build(minify=True, jobs=1, io_threads=2)
+        self.assertEqual(self.read(post), minified)
+
+    def test_site_index_slots(self):
+        self.write(self.template, "{{ Title }} {{ Date }}|{{ Prev }}|{{ Next }}|{{ Recent 2 }}")
+        for name, date in (("a", "2024-01-01"), ("b", "2024-02-01"), ("c", "2024-03-01")):
+            self.write(os.path.join(self.content, "blog", name + ".md"), f"---\ndate: {date}\n---\n# Post {name}\n")
+        os.remove(os.path.join(self.content, "blog", "post", "index.md"))
+        index_path = os.path.join(self.root, ".cache", "site-index.json")
+        self.assertEqual(self.build(site_index=SiteIndex(index_path)), 4)
+        recent = ('<ul class="pages"><li><a href="/blog/c.html">Post c</a> <time datetime="2024-03-01">2024-03-01</time></li>'
+                  '<li><a href="/blog/b.html">Post b</a> <time datetime="2024-02-01">2024-02-01</time></li></ul>')
+        self.assertEqual(self.read(os.path.join(self.docs, "blog", "b.html")),
+                         'Post b 2024-02-01|<a rel="prev" href="/blog/a.html">Post a</a>'
+                         '|<a rel="next" href="/blog/c.html">Post c</a>|' + recent)
+
+        # Retitling a rebuilds a and b, which links to it, and nothing else
+        site_index = SiteIndex.load(index_path)
+        self.assertEqual(len(site_index.pages), 4)
+        self.write(os.path.join(self.content, "blog", "a.md"), "---\ndate: 2024-01-01\n---\n# Post A\n")
+        self.assertEqual(self.build(site_index=site_index), 2)
+        self.assertIn('"prev" href="/blog/a.html">Post A</a>', self.read(os.path.join(self.docs, "blog", "b.html")))
+        # Redating a to the newest changes every page's recent list
+        self.write(os.path.join(self.content, "blog", "a.md"), "---\ndate: 2025-01-01\n---\n# Post A\n")
+        self.assertEqual(self.build(site_index=site_index), 4)
+        self.assertEqual(self.build(site_index=site_index), 0)
+
+    def test_section_listings_with_a_count(self):
+        self.write(self.template, "{{ Pages 5 }}")
+        self.write(os.path.join(self.content, "blog", "index.md"), "# Blog")
+        self.write(os.path.join(self.content, "news", "index.md"), "# News")
+        self.write(os.path.join(self.content, "news", "today.md"), "# Today")
+        self.build(site_index=SiteIndex(os.path.join(self.root, ".cache", "site-index.json")))
+        # Each index lists its own section, whichever renders first
+        self.assertEqual(self.read(os.path.join(self.docs, "blog", "index.html")),
+                         '<ul class="pages"><li><a href="/blog/post/">Post</a></li></ul>')
+        self.assertEqual(self.read(os.path.join(self.docs, "news", "index.html")),
+                         '<ul class="pages"><li><a href="/news/today.html">Today</a></li></ul>')
+        self.assertEqual(self.read(os.path.join(self.docs, "index.html")),
+                         '<ul class="pages"><li><a href="/blog/">Blog</a></li><li><a href="/news/">News</a></li></ul>')
+
+    def test_check_reports_every_problem(self):
+        bad = os.path.join(self.content, "blog", "bad.md")
+        self.write(bad, "---\ndate: 2024-01-01\n---\n# Bad\n\none **two\nthree _four\n\n- [ok](/)\n- [gone](/nope/)\n- `five\n")
+        untitled = os.path.join(self.content, "untitled.md")
+        self.write(untitled, "no title [post](blog/post/)")
+        checked, problems = check_site(self.content, self.template, self.docs, jobs=1)
+        self.assertEqual(checked, 4)
+        # Front matter lines count, and a page's problems come in line order
+        self.assertEqual(sorted(problems, key=lambda problem: problem[0]), [
+            (bad, 6, "missing closing delimiter"),
+            (bad, 7, "missing closing delimiter"),
+            (bad, 10, "broken link /nope/"),
+            (bad, 11, "missing closing delimiter"),
+            (untitled, None, "no header found"),
+        ])
+        self.assertEqual(check_site(self.content, self.template, self.docs, jobs=2), (checked, problems))
+        self.assertFalse(os.path.exists(self.docs))
+        # The pages check flags are the ones the build fails on
+        with self.assertRaises(BuildError) as cm:
+            self.build()
+        self.assertEqual(sorted(path for path, _ in cm.exception.errors), sorted([bad, untitled]))
+
+    def test_identical_output_is_not_rewritten(self):
+        self.build()
+        path = os.path.join(self.docs, "index.html")
+        os.utime(path, ns=(0, 0))
+        out = StringIO()
+        with redirect_stdout(out):
+            build_site(self.content, self.template, self.docs, "/", self.manifest, force=True)
+        self.assertIn("Generated 2 pages (0 written, 2 identical)", out.getvalue())
+        self.assertEqual(os.stat(path).st_mtime_ns, 0)
+        # A page that fails halfway leaves the old output and no temp file behind
+        self.write(os.path.join(self.content, "index.md"), "# Home\n\n**unclosed")
+        with self.assertRaises(BuildError):
+            self.build(force=True)
+        self.assertEqual(sorted(os.listdir(self.docs)), ["blog", "index.html"])
+        self.assertIn("hello", self.read(path))
+
+    def test_identical_output_is_compared_by_recorded_digest(self):
+        self.build()
+        path = os.path.join(self.docs, "index.html")
+        html = self.read(path)
+        # Neither the old pages nor temp files are touched
+        opened = []
+        digest_file, open_tmp = output.digest_file, output.OutputFile.open
+        output.digest_file = lambda path: opened.append(path)
+        output.OutputFile.open = lambda out: opened.append(out.tmp_path)
+        try:
+            out = StringIO()
+            with redirect_stdout(out):
+                build_site(self.content, self.template, self.docs, "/", self.manifest, force=True)
+        finally:
+            output.digest_file, output.OutputFile.open = digest_file, open_tmp
+        self.assertIn("Generated 2 pages (0 written, 2 identical)", out.getvalue())
+        self.assertEqual(opened, [])
+        # Unless a page was changed behind the build's back
+        self.write(path, html.replace("hello", "HELLO"))
+        out = StringIO()
+        with redirect_stdout(out):
+            build_site(self.content, self.template, self.docs, "/", self.manifest, force=True)
+        self.assertIn("Generated 2 pages (1 written, 1 identical)", out.getvalue())
+        self.assertEqual(self.read(path), html)
+
+    def test_precompress_only_changed_files(self):
+        import gzip
+        self.build()
+        self.write(os.path.join(self.docs, "archive.tar.gz"), "not ours")
+        with redirect_stdout(StringIO()):
+            self.assertEqual(precompress_tree(self.docs)["compressed"], 2)
+            self.assertEqual(precompress_tree(self.docs)["compressed"], 0)
+        with gzip.open(os.path.join(self.docs, "index.html.gz"), "rt", encoding="utf-8") as f:
+            self.assertEqual(f.read(), self.read(os.path.join(self.docs, "index.html")))
+
+        self.write(os.path.join(self.content, "index.md"), "# Home\n\nchanged")
+        os.remove(os.path.join(self.content, "blog", "post", "index.md"))
+        self.build()
+        with redirect_stdout(StringIO()):
+            stats = precompress_tree(self.docs, level=1)
+        self.assertEqual((stats["compressed"], stats["removed"]), (1, 1))
+        self.assertFalse(os.path.exists(os.path.join(self.docs, "blog")))
+        self.assertTrue(os.path.exists(os.path.join(self.docs, "archive.tar.gz")))
+
+    def test_fingerprinted_assets(self):
+        import struct
+        static = os.path.join(self.root, "static")
+        png = b"\x89PNG\r\n\x1a\n" + struct.pack(">I", 13) + b"IHDR" + struct.pack(">II", 640, 480) + b"rest"
+        os.makedirs(os.path.join(static, "images"))
+        with open(os.path.join(static, "images", "a.png"), "wb") as f:
+            f.write(png)
+        self.write(os.path.join(static, "index.css"), "body {}")
+        self.write(self.template, '<link href="/index.css">{{ Content }}')
+        self.write(os.path.join(self.content, "index.md"), "# Home\n\n![a](/images/a.png)")
+
+        assets = AssetManifest.build(static)
+        css = assets.get("/index.css")["path"]
+        self.assertRegex(css, r"^/index\.[0-9a-f]{10}\.css$")
+        with redirect_stdout(StringIO()):
+            sync_files_recursive(static, self.docs, manifest_path=os.path.join(self.root, "static.json"),
+                                 names=assets.names())
+        self.build("/site/", assets=assets)
+        self.assertTrue(os.path.exists(self.docs + css))
+        self.assertFalse(os.path.exists(os.path.join(self.docs, "index.css")))
+        html = self.read(os.path.join(self.docs, "index.html"))
+        image = assets.get("/images/a.png")["path"]
+        self.assertIn(f'<link href="/site{css}">', html)
+        self.assertIn(f'<img src="/site{image}" alt="a" width="640" height="480">', html)
+
+        # Unchanged files keep their hash without being read again
+        self.assertEqual(AssetManifest.build(static, assets).digest, assets.digest)
+
+    def test_cached_blocks_with_relative_assets(self):
+        import struct
+        static = os.path.join(self.root, "static")
+        for name, width in (("a", 10), ("b", 20)):
+            png = b"\x89PNG\r\n\x1a\n" + struct.pack(">I", 13) + b"IHDR" + struct.pack(">II", width, 5) + name.encode()
+            os.makedirs(os.path.join(static, name))
+            with open(os.path.join(static, name, "pic.png"), "wb") as f:
+                f.write(png)
+            self.write(os.path.join(self.content, name, "index.md"), "# Pic\n\n![pic](pic.png)")
+        assets = AssetManifest.build(static)
+        # The same block on both pages: each gets its own directory's image
+        self.build(assets=assets, block_cache=BlockCache())
+        for name, width in (("a", 10), ("b", 20)):
+            image = assets.get(f"/{name}/pic.png")["path"]
+            self.assertIn(f'<img src="{image}" alt="pic" width="{width}" height="5">',
+                          self.read(os.path.join(self.docs, name, "index.html")))
+
+    def test_pages_follow_only_their_assets(self):
+        static = os.path.join(self.root, "static")
+        self.write(os.path.join(static, "index.css"), "body {}")
+        self.write(os.path.join(static, "a.txt"), "a")
+        self.write(self.template, '<link href="/index.css">{{ Content }}')
+        self.write(os.path.join(self.content, "index.md"), "# Home\n\n[a](/a.txt) [b](/b.txt)")
+        cache = BlockCache()
+        assets = AssetManifest.build(static)
+        self.assertEqual(self.build(assets=assets, block_cache=cache), 2)
+        # Files no page points at change nothing
+        self.write(os.path.join(static, "unrelated.txt"), "x")
+        assets = AssetManifest.build(static, assets)
+        self.assertEqual(self.build(assets=assets, block_cache=cache), 0)
+        # Only the page linking to a file is rebuilt when it changes, or appears
+        home = os.path.join(self.docs, "index.html")
+        for name in ("a.txt", "b.txt"):
+            self.write(os.path.join(static, name), "changed")
+            assets = AssetManifest.build(static, assets)
+            self.assertEqual(self.build(assets=assets, block_cache=cache), 1)
+            self.assertIn(assets.get("/" + name)["path"], self.read(home))
+        # The template's own assets are on every page
+        self.write(os.path.join(static, "index.css"), "body { margin: 0 }")
+        assets = AssetManifest.build(static, assets)
+        self.assertEqual(self.build(assets=assets, block_cache=cache), 2)
+        self.assertIn(assets.get("/index.css")["path"], self.read(home))
+
+    def read_shard(self, name):
+        # Decodes a search shard the way search.js does
+        with open(os.path.join(self.docs, "search", name + ".bin"), "rb") as f:
+            data = f.read()
+        pos = 0
+
+        def varint():
+            nonlocal pos
+            value = shift = 0
+            while True:
+                byte = data[pos]
+                pos += 1
+                value |= (byte & 0x7F) << shift
+                shift += 7
+                if byte < 0x80:
+                    return value
+
+        terms = {}
+        for _ in range(varint()):
+            length = varint()
+            term = data[pos:pos + length].decode("utf-8")
+            pos += length
+            count = varint()
+            ids = []
+            for _ in range(count):
+                ids.append((ids[-1] if ids else 0) + varint())
+            terms[term] = list(zip(ids, [varint() for _ in range(count)]))
+        return terms
+
+    def test_search_index(self):
+        import json
+        self.write(os.path.join(self.content, "index.md"), "# Home\n\nWorld [world](/blog/post) hello\n\n```\nworldly code\n```")
+        index_path = os.path.join(self.root, ".cache", "search.json")
+        self.build(search=SearchIndex.load(index_path))
+        with open(os.path.join(self.docs, "search", "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        pages = {tuple(page): page_id for page_id, page in enumerate(meta["pages"])}
+        home, post = pages[("/", "Home")], pages[("/blog/post/", "Post")]
+        self.assertEqual(self.read_shard("wo"), {"world": sorted([(home, 2), (post, 1)])})
+
+        # Only the pages that changed are indexed again
+        out = StringIO()
+        with redirect_stdout(out):
+            build_site(self.content, self.template, self.docs, "/", self.manifest, search=SearchIndex.load(index_path))
+        self.assertIn("Search index: 2 pages, 0 files updated", out.getvalue())
+        os.remove(os.path.join(self.content, "index.md"))
+        self.build(search=SearchIndex.load(index_path))
+        self.assertEqual(self.read_shard("wo"), {"world": [(post, 1)]})
+        self.assertFalse(os.path.exists(os.path.join(self.docs, "search", "he.bin")))
+
+    @unittest.skipIf(shutil.which("node") is None, "node is not installed")
+    def test_search_js_finds_short_prefixes(self):
+        import json
+        import subprocess
+        self.write(os.path.join(self.content, "index.md"), "# Home\n\nworld wonder hello")
+        self.build(search=SearchIndex(os.path.join(self.root, "search.json")))
+        # search.js with fetch reading the files it would download
+        harness = """
+            const fs = require("fs"), vm = require("vm"), url = require("url");
+            const [script, query] = process.argv.slice(1);
+            globalThis.document = { currentScript: { src: url.pathToFileURL(script).href } };
+            globalThis.fetch = async file => {
+              const data = fs.readFileSync(file);
+              return { json: async () => JSON.parse(data),
+                       arrayBuffer: async () => data.buffer.slice(data.byteOffset, data.byteOffset + data.length) };
+            };
+            vm.runInThisContext(fs.readFileSync(script, "utf8"));
+            search(query).then(results => console.log(JSON.stringify(results)));
+        """
+        script = os.path.join(self.docs, "search", "search.js")
+
+        def search(query):
+            result = subprocess.run(["node", "-e", harness, script, query], capture_output=True, text=True, check=True)
+            return {(page["url"], page["score"]) for page in json.loads(result.stdout)}
+
+        # One letter spans the shards of every term starting with it
+        self.assertEqual(search("w"), {("/", 2), ("/blog/post/", 1)})
+        self.assertEqual(search("wor"), {("/", 1), ("/blog/post/", 1)})
+        self.assertEqual(search("h w"), {("/", 4)})
+        self.assertEqual(search("x"), set())
+
+    def test_shards_merge_into_a_full_build(self):
+        for name in ("a", "b", "c", "d"):
+            self.write(os.path.join(self.content, name, "index.md"), f"# {name}\n\n[home](/)")
+        self.build()
+        shards = [os.path.join(self.root, "shards", str(i)) for i in (1, 2, 3)]
+        with redirect_stdout(StringIO()):
+            built = [build_shard(self.content, self.template, "/", (i, 3), dest_dir_path=shards[i - 1],
+                                 manifest_path=os.path.join(self.root, f"m{i}.json"))["pages"] for i in (1, 2, 3)]
+        # Every page lands in exactly one shard
+        self.assertEqual(sorted(page for pages in built for page in pages),
+                         sorted(["index.html", "blog/post/index.html"] + [f"{n}/index.html" for n in "abcd"]))
+
+        merged = os.path.join(self.root, "merged")
+        merge_path = os.path.join(self.root, "merged.json")
+        with self.assertRaises(ShardError) as cm:
+            merge_shards(shards[:2], merged, merge_manifest_path=merge_path)
+        self.assertIn("shard 3/3 is missing", cm.exception.problems)
+        self.assertFalse(os.path.exists(merged))
+
+        merge_shards(shards, merged, merge_manifest_path=merge_path)
+        for page in built[0]:
+            self.assertEqual(self.read(os.path.join(merged, page)), self.read(os.path.join(self.docs, page)))
+        stats = merge_shards(shards, merged, merge_manifest_path=merge_path)
+        self.assertEqual((stats["copied"], stats["unchanged"]), (0, 6))
+
+    def test_malformed_shard_manifest(self):
+        import json
+        shard = os.path.join(self.root, "shards", "1")
+        with redirect_stdout(StringIO()):
+            build_shard(self.content, self.template, "/", (1, 1), dest_dir_path=shard,
+                        manifest_path=os.path.join(self.root, "m1.json"))
+        manifest_path = os.path.join(shard, "shard-manifest.json")
+        with open(manifest_path, encoding="utf-8") as f:
+            data = json.load(f)
+        del data["build_key"]
+        data["pages"]["index.html"] = {}
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        with self.assertRaises(ShardError) as cm:
+            merge_shards([shard], os.path.join(self.root, "merged"), merge_manifest_path=os.path.join(self.root, "x.json"))
+        self.assertEqual(cm.exception.problems, [f"{manifest_path}: shard manifest missing field build_key"])
+        data["build_key"] = ""
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        with self.assertRaises(ShardError) as cm:
+            merge_shards([shard], os.path.join(self.root, "merged"), merge_manifest_path=os.path.join(self.root, "x.json"))
+        self.assertEqual(cm.exception.problems, [f"{manifest_path}: shard manifest page index.html missing field hash"])
+
+    def test_links_are_resolved_and_checked(self):
+        self.write(os.path.join(self.content, "index.md"),
+                   "# Home\n\n[post](blog/post/index.md) [gone](/blog/gone) ![img](/a.png)\n\n"
+                   "```\n<a href=\"/literal\">\n```\n\n"
+                   "<a href=\"/blog/post/\">raw</a> <img src=\"/b.png\"> <a href=\"//cdn/x\">cdn</a> `<a href=\"/code\">`")
+        out = StringIO()
+        with redirect_stdout(out):
+            build_site(self.content, self.template, self.docs, "/site/", self.manifest, block_cache=BlockCache())
+        html = self.read(os.path.join(self.docs, "index.html"))
+        self.assertIn('<a href="/site/">home</a>', html)
+        self.assertIn('<a href="blog/post/index.html">post</a> <a href="/site/blog/gone">gone</a>', html)
+        self.assertIn('<img src="/site/a.png" alt="img"></img>', html)
+        # Raw html gets the basepath too, but code isn't a url
+        self.assertIn('<p><a href="/site/blog/post/">raw</a> <img src="/site/b.png"> <a href="//cdn/x">cdn</a> '
+                      '<code><a href="/code"></code></p>', html)
+        self.assertIn('<a href="/literal">', html)
+        self.assertIn("Broken link in", out.getvalue())
+        self.assertIn(": /blog/gone\n", out.getvalue())
+        self.assertNotIn("blog/post/index.md\n", out.getvalue())
+
+    def test_errors_are_reported_per_page(self):
+        self.write(os.path.join(self.content, "bad.md"), "no title here")
+        self.write(os.path.join(self.content, "worse.md"), "# Title\n\n**unclosed")
+        with self.assertRaises(BuildError) as cm:
+            self.build(jobs=2)
+        failed = sorted(os.path.basename(path) for path, _ in cm.exception.errors)
+        self.assertEqual(failed, ["bad.md", "worse.md"])
+        # The good pages were still built and aren't rebuilt next time
+        self.assertTrue(os.path.exists(os.path.join(self.docs, "index.html")))
+        os.remove(os.path.join(self.content, "bad.md"))
+        os.remove(os.path.join(self.content, "worse.md"))
+        self.assertEqual(self.build(), 0)
+
+    def test_profile_records_every_page_and_stage(self):
+        profiler = Profiler()
+        self.build(profiler=profiler)
+        self.assertEqual(len(profiler.pages), 2)
+        for stage in ["read", "parse", "render", "write"]:
+            self.assertIn(stage, profiler.stages)
+        self.assertEqual(profiler.stages["write"]["bytes"], sum(page["bytes"] for page in profiler.pages))
+        self.assertEqual(len(profiler.slowest(1)), 1)
+        report = os.path.join(self.root, "profile.csv")
+        profiler.write(report)
+        with open(report) as f:
+            self.assertEqual(len(f.read().splitlines()), 3)
+
+    def test_synthetic_corpus_builds(self):
+        spec = CorpusSpec(pages=30, static_files=2, static_bytes=16, seed=7)
+        paths = generate_corpus(os.path.join(self.root, "corpus"), spec)
+        with redirect_stdout(StringIO()):
+            generated = build_site(paths["content"], paths["template"], self.docs, "/", self.manifest)
+        self.assertEqual(generated, 30)
+
+    def test_dev_server_rebuilds_only_changed_pages(self):
+        static = os.path.join(self.root, "static")
+        self.write(os.path.join(static, "index.css"), "body {}")
+        server = DevServer(self.content, static, self.template, self.docs, manifest_path=self.manifest)
+        with redirect_stdout(StringIO()):
+            server.build_all()
+            before = snapshot([self.content, static, self.template])
+            home = os.path.join(self.docs, "index.html")
+
+            post = os.path.join(self.content, "blog", "post", "index.md")
+            self.write(post, "# Post\n\nedited")
+            os.remove(os.path.join(self.content, "index.md"))
+            changed, removed = diff_snapshots(before, snapshot([self.content, static, self.template]))
+            self.assertEqual(changed, {post})
+            server.rebuild(changed, removed)
+
+        self.assertIn("edited", self.read(os.path.join(self.docs, "blog", "post", "index.html")))
+        self.assertFalse(os.path.exists(home))
+
+    def check_watcher(self, make_watcher, settle=0):
+        # Each change is seen once, by what snapshot() would see
+        static = os.path.join(self.root, "static")
+        self.write(os.path.join(static, "index.css"), "body {}")
+        paths = [self.content, static, self.template]
+        post = os.path.join(self.content, "blog", "post", "index.md")
+        page = os.path.join(self.content, "new", "deep", "index.md")
+        watcher = make_watcher(paths)
+
+        def poll():
+            time.sleep(settle)
+            return watcher.poll()
+
+        try:
+            self.assertEqual(poll(), (set(), set()))
+            # Written in place, which leaves the directory's mtime alone
+            with open(post, "a", encoding="utf-8") as f:
+                f.write("\nmore")
+            self.assertEqual(poll(), ({post}, set()))
+            self.write(page, "# New")
+            self.write(self.template, "{{ Content }}")
+            self.assertEqual(poll(), ({page, self.template}, set()))
+            shutil.rmtree(os.path.join(self.content, "blog"))
+            self.assertEqual(poll(), (set(), {post}))
+            self.assertEqual(watcher.files, snapshot(paths))
+        finally:
+            watcher.close()
+
+    def test_polling_watcher(self):
+        self.check_watcher(PollingWatcher)
+
+    @unittest.skipIf(devserver.Observer is None, "watchdog is not installed")
+    def test_event_watcher(self):
+        self.check_watcher(EventWatcher, settle=0.3)
+
+    def test_daemon_renders_from_warm_state(self):
+        import json
+        import threading
+        import urllib.request
+        from http.server import ThreadingHTTPServer
+        static = os.path.join(self.root, "static")
+        os.makedirs(static)
+        daemon = BuildDaemon(self.content, static, self.template, self.docs, "/site/", manifest_path=self.manifest)
+        with redirect_stdout(StringIO()):
+            daemon.build_all()
+        post = os.path.join(self.content, "blog", "post", "index.md")
+        built = self.read(os.path.join(self.docs, "blog", "post", "index.html"))
+        self.assertEqual(daemon.render_path(post)["html"], built)
+        self.assertIs(daemon.document(post), daemon.document(post))
+        with self.assertRaises(ValueError):
+            daemon.render_path(self.template)
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), make_api_handler(daemon))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            request = urllib.request.Request(f"http://127.0.0.1:{server.server_port}/render-markdown",
+                                             json.dumps({"markdown": "[a](/b)"}).encode("utf-8"))
+            with urllib.request.urlopen(request) as response:
+                self.assertEqual(json.load(response)["html"], '<div><p><a href="/site/b">a</a></p></div>')
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_dev_server_serves_under_the_basepath(self):
+        import threading
+        import urllib.error
+        import urllib.request
+        from http.server import ThreadingHTTPServer
+        self.build("/site/")
+        server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(self.docs, Reloader(), "/site/"))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}"
+        try:
+            for path in ("/site/", "/site"):
+                with urllib.request.urlopen(url + path) as response:
+                    self.assertIn(b"<title>Home</title>", response.read())
+            with urllib.request.urlopen(url + "/site/blog/post/") as response:
+                self.assertIn(b"<title>Post</title>", response.read())
+            with self.assertRaises(urllib.error.HTTPError) as cm:
+                urllib.request.urlopen(url + "/blog/post/")
+            self.assertEqual(cm.exception.code, 404)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_daemon_rebuild_api(self):
+        import json
+        import threading
+        import urllib.error
+        import urllib.request
+        from http.server import ThreadingHTTPServer
+        static = os.path.join(self.root, "static")
+        os.makedirs(static)
+        daemon = BuildDaemon(self.content, static, self.template, self.docs, "/", manifest_path=self.manifest)
+        with redirect_stdout(StringIO()):
+            daemon.build_all()
+        server = ThreadingHTTPServer(("127.0.0.1", 0), make_api_handler(daemon))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        def rebuild(body):
+            request = urllib.request.Request(f"http://127.0.0.1:{server.server_port}/rebuild",
+                                             json.dumps(body).encode("utf-8"))
+            with redirect_stdout(StringIO()), urllib.request.urlopen(request) as response:
+                return json.load(response)["pages"]
+
+        post = os.path.join(self.content, "blog", "post", "index.md")
+        output = os.path.join(self.docs, "blog", "post", "index.html")
+        try:
+            # Absolute, or relative to where the daemon runs: both name the same page
+            for text, path in (("edited", post), ("again", os.path.relpath(post))):
+                self.write(post, f"# Post\n\n{text}")
+                self.assertEqual(rebuild({"changed": [path]}), [os.path.join(self.content, "blog", "post", "index.md")])
+                self.assertIn(text, self.read(output))
+            self.assertEqual(rebuild({}), [])
+            with self.assertRaises(urllib.error.HTTPError) as cm:
+                rebuild({"changed": [self.manifest]})
+            self.assertEqual(cm.exception.code, 400)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_daemon_renders_pages_as_built(self):
+        static = os.path.join(self.root, "static")
+        os.makedirs(static)
+        self.write(self.template, "<p>\n  <time>{{ Date }}</time> {{ Tags }}\n  {{ Prev }}{{ Next }}\n</p>\n{{ Content }}")
+        self.write(os.path.join(self.content, "blog", "a.md"), "---\ndate: 2024-05-05\ntags: x, y\n---\n# A\n")
+        self.write(os.path.join(self.content, "blog", "b.md"), "---\ndate: 2024-06-06\n---\n# B\n")
+        daemon = BuildDaemon(self.content, static, self.template, self.docs, "/site/", manifest_path=self.manifest,
+                             minify=True)
+        with redirect_stdout(StringIO()):
+            daemon.build_all()
+        built = self.read(os.path.join(self.docs, "blog", "a.html"))
+        self.assertEqual(built, '<p><time>2024-05-05</time> x, y <a rel="prev" href="/site/blog/post/">Post</a>'
+                                '<a rel="next" href="/site/blog/b.html">B</a></p><div><h1>A</h1></div>')
+        self.assertEqual(daemon.render_path(os.path.join(self.content, "blog", "a.md"))["html"], built)
+
+
+class TestStaticSync(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.static = os.path.join(self.tmp.name, "static")
+        self.docs = os.path.join(self.tmp.name, "docs")
+        self.manifest = os.path.join(self.tmp.name, ".cache", "static.json")
+        os.makedirs(os.path.join(self.static, "images"))
+        os.makedirs(self.docs)
+        for path, text in [("index.css", "body {}"), ("images/a.png", "aaa"), ("images/b.png", "bbb")]:
+            with open(os.path.join(self.static, path), "w") as f:
+                f.write(text)
+        with open(os.path.join(self.docs, "index.html"), "w") as f:
+            f.write("<html></html>")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def sync(self, **kwargs):
+        with redirect_stdout(StringIO()):
+            return sync_files_recursive(self.static, self.docs, manifest_path=self.manifest, **kwargs)
+
+    def test_only_changed_files_are_copied(self):
+        self.assertEqual(self.sync()["copied"], 3)
+        css = os.path.join(self.docs, "index.css")
+        mtime = os.stat(css).st_mtime_ns
+        self.assertEqual(self.sync(), {"copied": 0, "unchanged": 3, "removed": 0, "bytes": 0})
+        self.assertEqual(os.stat(css).st_mtime_ns, mtime)
+
+        with open(os.path.join(self.static, "index.css"), "w") as f:
+            f.write("body { color: red; }")
+        self.assertEqual(self.sync()["copied"], 1)
+        with open(css) as f:
+            self.assertEqual(f.read(), "body { color: red; }")
+
+    def test_checksum_skips_touched_files(self):
+        self.sync()
+        os.utime(os.path.join(self.static, "index.css"), ns=(0, 0))
+        self.assertEqual(self.sync(checksum=True)["copied"], 0)
+        self.assertEqual(self.sync()["copied"], 1)
+
+    def test_stale_files_removed_but_pages_kept(self):
+        self.sync()
+        os.remove(os.path.join(self.static, "images", "b.png"))
+        self.assertEqual(self.sync()["removed"], 1)
+        self.assertFalse(os.path.exists(os.path.join(self.docs, "images", "b.png")))
+        self.assertTrue(os.path.exists(os.path.join(self.docs, "images", "a.png")))
+        self.assertTrue(os.path.exists(os.path.join(self.docs, "index.html")))
+
+    def test_deep_trees_and_empty_directories(self):
+        deep = os.path.join(self.static, *["d"] * 50)
+        os.makedirs(deep)
+        with open(os.path.join(deep, "leaf.txt"), "w") as f:
+            f.write("leaf")
+        os.makedirs(os.path.join(self.static, "empty"))
+        self.assertEqual(self.sync()["copied"], 4)
+        self.assertTrue(os.path.isfile(os.path.join(self.docs, *["d"] * 50, "leaf.txt")))
+        self.assertTrue(os.path.isdir(os.path.join(self.docs, "empty")))
+
+    def test_hardlinks_are_never_written_through(self):
+        self.sync(link="hardlink")
+        src = os.path.join(self.static, "index.css")
+        dst = os.path.join(self.docs, "index.css")
+        self.assertTrue(os.path.samefile(src, dst))
+        # Replacing the source (like an editor does) relinks the output
+        os.remove(src)
+        with open(src, "w") as f:
+            f.write("new")
+        self.sync(link="copy")
+        self.assertFalse(os.path.samefile(src, dst))
+        with open(dst) as f:
+            self.assertEqual(f.read(), "new")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,7 +5,20 @@ from htmlnode import HTMLNode, LeafNode, ParentNode
 
 from inline import extract_markdown_images, extract_markdown_links, split_node_images, split_node_links, text_to_textnodes
 
+from textnode import make_html_node
+
 from block import markdown_to_blocks, block_to_block_type, BlockType, text_to_children, block_to_html, markdown_to_html_node
+from block import iter_typed_blocks, iter_file_lines, write_markdown_html, iter_blocks
+
+from template import compile_template, Slot
+
+from document import parse_document, split_front_matter
+
+from render_cache import BlockCache
+
+from urls import UrlResolver
+
+from minify import HtmlMinifier, minify_html
 
 
 class TestTextNode(unittest.TestCase):
@@ -53,12 +66,30 @@ class TestTextNode(unittest.TestCase):
             parent_node.to_html(),
             "<div><span><b>grandchild</b></span></div>",
         )
+    def test_write_html_streams_fragments(self):
+        import io
+        parent_node = ParentNode("div", [ParentNode("p", [LeafNode(None, "a "), LeafNode("b", "b")])])
+        parts = []
+        parent_node.write_html(parts.append)
+        self.assertEqual(parts, ["<div>", "<p>", "a ", "<b>b</b>", "</p>", "</div>"])
+        out = io.StringIO()
+        parent_node.write_html(out.write)
+        self.assertEqual(out.getvalue(), parent_node.to_html())
+
     def test_text(self):
         node = TextNode("This is a text node", TextType.TEXT)
         html_node = text_node_to_html_node(node)
         self.assertEqual(html_node.tag, None)
         self.assertEqual(html_node.value, "This is a text node")
 
+    def test_make_html_node_matches_text_node(self):
+        for node in [TextNode("a", TextType.TEXT), TextNode("b", TextType.BOLD), TextNode("l", TextType.LINK, "/x"), TextNode("i", TextType.IMAGE, "/i.png")]:
+            self.assertEqual(make_html_node(node.text, node.text_type, node.url).to_html(), text_node_to_html_node(node).to_html())
+
+    def test_nodes_use_slots(self):
+        for node in [TextNode("a", TextType.TEXT), LeafNode("b", "b"), ParentNode("p", [])]:
+            self.assertFalse(hasattr(node, "__dict__"))
+
     def test_delim_bold(self):
         # Test 1: Basic bold split
         node = TextNode("This is **bold** text", TextType.TEXT)
@@ -133,6 +164,40 @@ class TestTextNode(unittest.TestCase):
             ],
             nodes,
         )
+    def test_text_to_textnodes_precedence(self):
+        # Code wins over bold, bold over italic, delimiters over links
+        self.assertListEqual(
+            [
+                TextNode("a **b** _c_", TextType.CODE),
+                TextNode(" ", TextType.TEXT),
+                TextNode("x _y_ [l](u)", TextType.BOLD),
+                TextNode(" ", TextType.TEXT),
+                TextNode("[l](u)", TextType.ITALIC),
+            ],
+            text_to_textnodes("`a **b** _c_` **x _y_ [l](u)** _[l](u)_"),
+        )
+
+    def test_text_to_textnodes_unclosed(self):
+        for text in ["a `b", "**a", "_a **b** c_", "**a `b` c**", "a_b"]:
+            with self.assertRaises(Exception):
+                text_to_textnodes(text)
+
+    def test_text_to_textnodes_same_image_and_link(self):
+        self.assertListEqual(
+            [
+                TextNode("x", TextType.IMAGE, "u"),
+                TextNode(" and ", TextType.TEXT),
+                TextNode("x", TextType.LINK, "u"),
+            ],
+            text_to_textnodes("![x](u) and [x](u)"),
+        )
+
+    def test_text_to_textnodes_many_links(self):
+        text = " ".join(f"[l{i}](/p/{i})" for i in range(2000))
+        nodes = text_to_textnodes(text)
+        self.assertEqual(len(nodes), 3999)
+        self.assertEqual(nodes[-1], TextNode("l1999", TextType.LINK, "/p/1999"))
+
     def test_markdown_to_blocks(self):
         md = """
 This is **bolded** paragraph
@@ -153,6 +218,29 @@ This is the same paragraph on a new line
             ],
         )
 
+    def test_markdown_to_blocks_fenced_code_with_blank_lines(self):
+        md = "Intro\n\n```\nfirst\n\n\nsecond\n```\n\nOutro"
+        self.assertEqual(markdown_to_blocks(md), ["Intro", "```\nfirst\n\n\nsecond\n```", "Outro"])
+
+    def test_iter_typed_blocks_line_numbers(self):
+        md = "# Title\n\n\nsome\ntext\n\n- a\n- b\n"
+        self.assertEqual(
+            list(iter_typed_blocks(md.splitlines())),
+            [("# Title", BlockType.HEADING, 1), ("some\ntext", BlockType.PARAGRAPH, 4), ("- a\n- b", BlockType.UNORDERED_LIST, 7)],
+        )
+
+    def test_streamed_file_matches_in_memory(self):
+        import tempfile, os
+        md = "# Title\r\n\r\nA **bold** [link](/x)\r\n\r\n```\ncode\n\nmore\n```\n\n1. one\n2. two"
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "page.md")
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                f.write(md)
+            parts = []
+            write_markdown_html(iter_typed_blocks(iter_file_lines(path)), parts.append)
+            with open(path, encoding="utf-8") as f:
+                self.assertEqual("".join(parts), markdown_to_html_node(f.read()).to_html())
+
     def test_headings(self):
         self.assertEqual(block_to_block_type("# heading"), BlockType.HEADING)
         self.assertEqual(block_to_block_type("### heading"), BlockType.HEADING)
@@ -223,6 +311,112 @@ the **same** even with inline stuff
             html,
             "<div><pre><code>This is text that _should_ remain\nthe **same** even with inline stuff\n</code></pre></div>",
         )
+    def test_template_compiles_to_segments(self):
+        template = compile_template('<a href="/">{{ Title }}</a>{{Content}}', "/blog/")
+        self.assertEqual(template.segments, ['<a href="/blog/">', Slot("Title", ""), "</a>", Slot("Content", "")])
+        self.assertEqual(template.render({"Title": "t", "Content": "c"}), '<a href="/blog/">t</a>c')
+
+    def test_template_streamed_slot(self):
+        template = compile_template("<article>{{ Content }}</article>")
+        node = ParentNode("p", [LeafNode(None, "hi")])
+        self.assertEqual(template.render({"Content": node.write_html}), "<article><p>hi</p></article>")
+
+    def test_template_unknown_slot_kept(self):
+        template = compile_template("{{ Title }} {{ Author }}")
+        self.assertEqual(template.render({"Title": "t"}), "t {{ Author }}")
+
+    def test_template_partials(self):
+        import tempfile, os
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, "head.html"), "w") as f:
+                f.write("<title>{{ Title }}</title>")
+            template = compile_template("{{> head.html }}<body>{{ Content }}</body>", base_dir=tmp)
+            self.assertEqual(template.slots(), [Slot("Title", ""), Slot("Content", "")])
+            self.assertEqual(template.render({"Title": "t", "Content": "c"}), "<title>t</title><body>c</body>")
+
+    def test_minify_html(self):
+        html = '<!doctype html>\n<html>\n  <body>\n    <p>a  <b>b</b>\n c </p>\n<div>\n  <i>d</i></div>\n<pre><code>  x\n\n  y</code></pre>\n <p>\u00a0 <code>a  b</code></p>\n</body>\n</html>\n'
+        minified = '<!doctype html><html><body><p>a <b>b</b> c </p><div><i>d</i></div><pre><code>  x\n\n  y</code></pre><p>\u00a0 <code>a  b</code></p></body></html>'
+        self.assertEqual(minify_html(html), minified)
+        # Wherever the stream is cut, the result is the same
+        for cut in range(len(html) + 1):
+            minifier = HtmlMinifier()
+            self.assertEqual(minifier.minify(html[:cut]) + minifier.minify(html[cut:]) + minifier.finish(), minified)
+        for size in (1, 2, 5, 13):
+            minifier = HtmlMinifier()
+            parts = [minifier.minify(html[i:i + size]) for i in range(0, len(html), size)]
+            self.assertEqual("".join(parts) + minifier.finish(), minified)
+
+    def test_minified_template(self):
+        template = compile_template("<html>\n  <title>{{ Title }}</title>\n  <p>\n    {{ Content }}\n  </p>\n</html>\n", minify=True)
+        self.assertEqual(template.segments, ["<html><title>", Slot("Title", ""), "</title><p>", Slot("Content", ""), "</p></html>"])
+
+    def test_document(self):
+        md = "## Intro\n\n# Main **title**\n\nSome text\n\n### Deep"
+        document = parse_document(md)
+        self.assertEqual([t for _, t in document.blocks], [BlockType.HEADING, BlockType.HEADING, BlockType.PARAGRAPH, BlockType.HEADING])
+        self.assertEqual(document.title, "Main **title**")
+        self.assertEqual(document.headings, [(2, "Intro"), (1, "Main **title**"), (3, "Deep")])
+        self.assertEqual(document.html_node.to_html(), markdown_to_html_node(md).to_html())
+        self.assertIs(document.html_node, document.html_node)
+
+    def test_front_matter(self):
+        document = parse_document("---\ntitle: Ignored\nDate: 2024-05-01\ntags: [a, b ,]\n---\n# Post\n\ntext")
+        self.assertEqual(document.meta, {"title": "Ignored", "date": "2024-05-01", "tags": ["a", "b"]})
+        self.assertEqual(document.title, "Post")
+        self.assertEqual([t for _, t in document.blocks], [BlockType.HEADING, BlockType.PARAGRAPH])
+        # Blanked, not dropped, so block line numbers still match the file
+        meta, lines = split_front_matter(["---\n", "date: 1\n", "---\n", "# Post\n"])
+        self.assertEqual([block for block in iter_blocks(lines)], [("# Post", 4)])
+        # A fence that never closes is just markdown
+        meta, lines = split_front_matter(["---\n", "# Post\n"])
+        self.assertEqual((meta, list(lines)), ({}, ["---\n", "# Post\n"]))
+
+    def test_template_slot_arguments(self):
+        template = compile_template("{{ Recent 2 }}|{{Pages /blog/}}|{{ Recent }}")
+        self.assertEqual([slot.key for slot in template.slots()], ["Recent 2", "Pages /blog/", "Recent"])
+        self.assertEqual(len({Slot("Recent", "", ["2"]), *template.slots()}), 3)
+        self.assertEqual(template.render({"Recent 2": "r"}), "r|{{Pages /blog/}}|{{ Recent }}")
+
+    def test_document_without_title(self):
+        with self.assertRaises(Exception):
+            parse_document("## only a subheading").title
+
+    def test_block_cache_hits_and_lru(self):
+        cache = BlockCache(max_entries=2)
+        md = "Shared **disclaimer**\n\n```\ncode\n```\n\nShared **disclaimer**"
+        document = parse_document(md)
+        parts = []
+        document.write_html(parts.append, cache)
+        self.assertEqual("".join(parts), markdown_to_html_node(md).to_html())
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        cache.render("new block", BlockType.PARAGRAPH)
+        self.assertEqual(len(cache.entries), 2)
+        # The code block was the least recently used, so it's gone
+        cache.render("```\ncode\n```", BlockType.CODE)
+        self.assertEqual((cache.hits, cache.misses), (1, 4))
+
+    def test_block_cache_persists(self):
+        import tempfile, os
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "blocks.pickle")
+            cache = BlockCache(path=path)
+            cache.render("a [link](/x)", BlockType.PARAGRAPH)
+            cache.save()
+            again = BlockCache(path=path)
+            again.load()
+            self.assertEqual(again.render("a [link](/x)", BlockType.PARAGRAPH), '<p>a <a href="/x">link</a></p>')
+            self.assertEqual((again.hits, again.misses), (1, 0))
+
+    def test_url_resolver(self):
+        resolver = UrlResolver("/site/", targets={"/index.html", "/blog/tom/index.html"}, page="/blog/tom/index.html")
+        self.assertEqual(resolver.resolve("/blog/tom"), "/site/blog/tom")
+        self.assertEqual(resolver.resolve("../majesty/index.md#top"), "../majesty/index.html#top")
+        self.assertEqual(resolver.resolve("https://example.com/x.md"), "https://example.com/x.md")
+        self.assertEqual(resolver.resolve("/"), "/site/")
+        self.assertEqual(resolver.rewrite("//cdn.example.com/a.png"), "//cdn.example.com/a.png")
+        self.assertEqual(resolver.broken, ["../majesty/index.md#top"])
+
 
 if __name__ == "__main__":
     unittest.main()
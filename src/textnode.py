@@ -11,6 +11,8 @@ class TextType(Enum):
 
 
 class TextNode:
+    __slots__ = ("text", "text_type", "url")
+
     def __init__(self, text, text_type, url=None):
         self.text = text
         self.text_type = text_type
@@ -24,22 +26,27 @@ class TextNode:
 
 
 def text_node_to_html_node(text_node):
-    match text_node.text_type:
+    return make_html_node(text_node.text, text_node.text_type, text_node.url)
+
+
+def make_html_node(text, text_type, url=None):
+    # Same as text_node_to_html_node, without needing a TextNode first
+    match text_type:
         case TextType.TEXT:
-            return LeafNode(None, text_node.text)
+            return LeafNode(None, text)
 
         case TextType.BOLD:
-            return LeafNode("b", text_node.text)
+            return LeafNode("b", text)
         case TextType.ITALIC:
-            return LeafNode("i", text_node.text)
+            return LeafNode("i", text)
         case TextType.CODE:
-            return LeafNode("code", text_node.text)
+            return LeafNode("code", text)
         case TextType.LINK:
-            return LeafNode("a", text_node.text, {"href": text_node.url})
+            return LeafNode("a", text, {"href": url})
         case TextType.IMAGE:
-            return LeafNode("img","",{"src": text_node.url, "alt": text_node.text})
+            return LeafNode("img","",{"src": url, "alt": text})
         case _:
-            raise Exception(f"invalid text type{text_node.text_type}")
+            raise Exception(f"invalid text type{text_type}")
 
 def split_nodes_delimiter(old_nodes, delimiter, text_type):
     new_nodes = []
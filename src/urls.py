@@ -0,0 +1,145 @@
+import os
+import posixpath
+import re
+
+from textnode import TextType, make_html_node
+
+# href="..." and src="..." attributes, in the template and in raw html
+URL_ATTRIBUTE = re.compile(r'\b(href|src)="([^"]*)"')
+
+# The resolver pages render with when they're built as part of a whole site,
+# set with set_site_resolver. Worker processes get their own copy.
+site_resolver = None
+
+
+def set_site_resolver(resolver):
+    global site_resolver
+    site_resolver = resolver
+
+
+def site_path(dest_path, dest_dir_path):
+    # docs/blog/tom/index.html -> /blog/tom/index.html
+    return "/" + os.path.relpath(dest_path, dest_dir_path).replace(os.sep, "/")
+
+
+def is_external(url):
+    # Other sites, other schemes (mailto:, data:...) and in-page anchors
+    return url.startswith(("#", "//")) or ":" in url.split("/", 1)[0]
+
+
+def is_page_path(path):
+    # Links to pages, as opposed to files in static/
+    return posixpath.splitext(posixpath.basename(md_to_html(path)))[1] in ("", ".html")
+
+
+def split_url(url):
+    # "a/b.md?x#y" -> ("a/b.md", "?x#y")
+    for index, char in enumerate(url):
+        if char in "?#":
+            return url[:index], url[index:]
+    return url, ""
+
+
+def md_to_html(path):
+    if path.endswith(".md"):
+        return path[:-3] + ".html"
+    return path
+
+
+class UrlResolver:
+    # Turns the urls written in markdown into urls of the built site:
+    # site-absolute ones get the basepath, links to .md files point at the
+    # page built from them, and links to pages that don't exist are
+    # collected in `broken`. With an AssetManifest, urls of static files
+    # point at their fingerprinted copies
+    def __init__(self, basepath="/", dest_dir_path=None, targets=None, page=None, assets=None):
+        self.basepath = basepath
+        self.assets = assets
+        # What the rewritten urls depend on, for caching rendered html, apart
+        # from the static files they point at: those are in asset_hashes
+        self.cache_key = basepath if assets is None else f"{basepath}\0assets"
+        self.dest_dir_path = dest_dir_path
+        # Site paths ("/blog/tom/index.html") of every page, None to skip checking
+        self.targets = targets
+        # Site path of the page being rendered, for relative links
+        self.page = page
+        # Every link url checked while rendering the page, as written
+        self.links = []
+        self.broken = []
+        # (site path, hash) of every static file looked up while rendering
+        # the page, with None for files that weren't there
+        self.asset_hashes = []
+
+    def for_page(self, dest_path):
+        page = site_path(dest_path, self.dest_dir_path)
+        return UrlResolver(self.basepath, self.dest_dir_path, self.targets, page, self.assets)
+
+    def asset(self, url):
+        # The AssetManifest entry of a (site-absolute or page-relative) url
+        if self.assets is None or is_external(url):
+            return None
+        path = split_url(url)[0]
+        if not path.startswith("/"):
+            if self.page is None:
+                return None
+            path = posixpath.normpath(posixpath.join(posixpath.dirname(self.page), path))
+        entry = self.assets.get(path)
+        # A missing file counts too: adding it changes the url
+        if entry is not None or not is_page_path(path):
+            self.asset_hashes.append((path, entry["hash"] if entry is not None else None))
+        return entry
+
+    def rewrite(self, url):
+        if is_external(url):
+            return url
+        path, rest = split_url(url)
+        asset = self.asset(path)
+        if asset is not None:
+            return self.basepath + asset["path"][1:] + rest
+        path = md_to_html(path)
+        if path.startswith("/"):
+            path = self.basepath + path[1:]
+        return path + rest
+
+    def resolve(self, url):
+        self.check(url)
+        return self.rewrite(url)
+
+    def check(self, url):
+        self.links.append(url)
+        if self.targets is None or self.page is None or is_external(url):
+            return
+        path = md_to_html(split_url(url)[0])
+        # Only links to pages are checked, not links to files in static/
+        if not is_page_path(path):
+            return
+        if not path.startswith("/"):
+            path = posixpath.join(posixpath.dirname(self.page), path)
+        path = posixpath.normpath(path)
+        if path in self.targets or posixpath.join(path, "index.html") in self.targets:
+            return
+        self.broken.append(url)
+
+    def rewrite_html(self, html):
+        # Raw html written in the markdown: its site-absolute href and src
+        # urls are rewritten the way the template's are
+        if 'href="/' not in html and 'src="/' not in html:
+            return html
+        return URL_ATTRIBUTE.sub(lambda m: f'{m.group(1)}="{self.rewrite(m.group(2))}"'
+                                 if m.group(2).startswith("/") else m.group(0), html)
+
+    def make_html_node(self, text, text_type, url=None):
+        # make_html_node for tokenize_inline, with the urls resolved
+        if text_type == TextType.TEXT:
+            return make_html_node(self.rewrite_html(text), text_type)
+        if text_type == TextType.LINK:
+            url = self.resolve(url)
+        elif text_type == TextType.IMAGE:
+            node = make_html_node(text, text_type, self.rewrite(url))
+            # Intrinsic size from the file header, so the page doesn't reflow
+            asset = self.asset(url)
+            if asset is not None and "width" in asset:
+                node.props["width"] = str(asset["width"])
+                node.props["height"] = str(asset["height"])
+            return node
+        return make_html_node(text, text_type, url)
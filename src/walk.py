@@ -0,0 +1,35 @@
+import os
+
+
+def walk_tree(root, extension=None, dirs=False):
+    # Yields (DirEntry, relpath) for every file under root whose name ends
+    # with extension, and for every directory too with dirs=True (before its
+    # contents). Depth first, in directory order, without recursion: only
+    # one scandir iterator is open per level, so memory grows with the depth
+    # of the tree, not with how many files it holds. The DirEntry carries
+    # the file type from the listing, so telling files from directories
+    # costs no extra stat.
+    stack = [(os.scandir(root), "")]
+    try:
+        while stack:
+            entries, prefix = stack[-1]
+            entry = next(entries, None)
+            if entry is None:
+                entries.close()
+                stack.pop()
+                continue
+            relpath = prefix + entry.name
+            if entry.is_dir():
+                if dirs:
+                    yield entry, relpath
+                try:
+                    stack.append((os.scandir(entry.path), relpath + os.sep))
+                except (FileNotFoundError, NotADirectoryError):
+                    # Removed (or replaced by a file) since it was listed
+                    continue
+            elif entry.is_file() and (extension is None or entry.name.endswith(extension)):
+                yield entry, relpath
+    finally:
+        # The caller stopped early
+        for entries, _ in stack:
+            entries.close()